@@ -11,12 +11,13 @@ if TYPE_CHECKING:
 
 class VBox:
     VBOX_XML_NAMESPACE = "{http://www.virtualbox.org/}"
+    DISK_XPATH = f".//{VBOX_XML_NAMESPACE}HardDisk[@location][@type='Normal']"
 
     def __init__(self, fh: TextIO):
-        self._xml: Element = ElementTree.fromstring(fh.read())
+        self._xml: Element = ElementTree.parse(fh).getroot()
 
     def disks(self) -> Iterator[str]:
-        for hdd_elem in self._xml.findall(f".//{self.VBOX_XML_NAMESPACE}HardDisk[@location][@type='Normal']"):
+        for hdd_elem in self._xml.iterfind(self.DISK_XPATH):
             # Allow format specifier to be case-insensitive (i.e. VDI, vdi)
             if (format := hdd_elem.get("format")) and format.lower() == "vdi":
                 yield hdd_elem.attrib["location"]
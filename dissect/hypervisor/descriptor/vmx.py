@@ -41,6 +41,8 @@ PASS2KEY_MAP = {
     "PBKDF2-HMAC-SHA-256": "sha256",
 }
 
+RE_CRYPTO_DICT = re.compile(r"([^:=]+)=([^:]*)")
+
 
 class VMX:
     def __init__(self, attr: dict[str, str]):
@@ -333,16 +335,13 @@ def _split_list(value: str) -> list[str]:
 def _parse_crypto_dict(dict_string: str) -> dict[str, str]:
     """Parse a crypto dict from a string.
 
-    Crypto dicts are encoded as ``key=encoded_value:key=encoded_value``.
+    Crypto dicts are encoded as ``key=encoded_value:key=encoded_value``. Malformed parts without a ``=`` are
+    skipped, they have no value to speak of.
 
     Internally called ``CryptoDict``.
     """
 
-    crypto_dict = {}
-    for part in dict_string.split(":"):
-        key, _, value = part.partition("=")
-        crypto_dict[key] = unquote(value)
-    return crypto_dict
+    return {key: unquote(value) for key, value in RE_CRYPTO_DICT.findall(dict_string)}
 
 
 def _decrypt_hmac(key: bytes, data: bytes, digest: str) -> bytes:
@@ -354,6 +353,7 @@ def _decrypt_hmac(key: bytes, data: bytes, digest: str) -> bytes:
 
     digest, digest_size = HMAC_MAP[digest]
 
+    # Plain bytes slices, not every cipher backend accepts a memoryview
     iv, encrypted, mac = data[:16], data[16:-digest_size], data[-digest_size:]
     cipher = _create_cipher(key, iv)
 
@@ -362,8 +362,7 @@ def _decrypt_hmac(key: bytes, data: bytes, digest: str) -> bytes:
         # PKCS#7 padding
         decrypted = decrypted[: -decrypted[-1]]
 
-    # We don't do any secret crypto so we don't care about the warning in the docs about timing attacks
-    if hmac.digest(key, decrypted, digest) != mac:
+    if not hmac.compare_digest(hmac.digest(key, decrypted, digest), mac):
         raise ValueError("Invalid HMAC, wrong key?")
 
     return decrypted
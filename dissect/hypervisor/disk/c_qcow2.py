@@ -154,26 +154,47 @@ QCOW2_INCOMPAT_MASK = (
 QCow2ClusterType = c_qcow2.QCow2ClusterType
 QCow2SubclusterType = c_qcow2.QCow2SubclusterType
 
-NORMAL_SUBCLUSTER_TYPES = (
-    QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL,
-    QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_ALLOC,
-    QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_ALLOC,
+NORMAL_SUBCLUSTER_TYPES = frozenset(
+    (
+        QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL,
+        QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_ALLOC,
+        QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_ALLOC,
+    )
 )
 
-ZERO_SUBCLUSTER_TYPES = (
-    QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_PLAIN,
-    QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_ALLOC,
+ZERO_SUBCLUSTER_TYPES = frozenset(
+    (
+        QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_PLAIN,
+        QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_ALLOC,
+    )
 )
 
-UNALLOCATED_SUBCLUSTER_TYPES = (
-    QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN,
-    QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_ALLOC,
+UNALLOCATED_SUBCLUSTER_TYPES = frozenset(
+    (
+        QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN,
+        QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_ALLOC,
+    )
 )
 
+# Subcluster type of every cluster type in images without subclusters
+CLUSTER_TO_SUBCLUSTER_TYPE = {
+    QCow2ClusterType.QCOW2_CLUSTER_UNALLOCATED: QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN,
+    QCow2ClusterType.QCOW2_CLUSTER_ZERO_PLAIN: QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_PLAIN,
+    QCow2ClusterType.QCOW2_CLUSTER_ZERO_ALLOC: QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_ALLOC,
+    QCow2ClusterType.QCOW2_CLUSTER_NORMAL: QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL,
+    QCow2ClusterType.QCOW2_CLUSTER_COMPRESSED: QCow2SubclusterType.QCOW2_SUBCLUSTER_COMPRESSED,
+}
+
 
 def ctz(value: int, size: int = 32) -> int:
-    """Count the number of zero bits in an integer of a given size."""
-    for i in range(size):
-        if value & (1 << i):
-            return i
-    return 0
+    """Count the number of trailing zero bits in an integer of a given size."""
+    value &= (1 << size) - 1
+    if not value:
+        return size
+    # Isolate the lowest set bit, its position is the number of trailing zeroes
+    return (value & -value).bit_length() - 1
+
+
+def cto(value: int, size: int = 32) -> int:
+    """Count the number of trailing one bits in an integer of a given size."""
+    return ctz(~value, size)
@@ -106,6 +106,10 @@ c_vhdx = cstruct().load(vhdx_def)
 ALIGNMENT = 64 * 1024
 MB = 1024 * 1024
 
+# Masks and shifts for decoding a bat_entry from its raw uint64 value
+BAT_ENTRY_STATE_MASK = (1 << 3) - 1
+BAT_ENTRY_FILE_OFFSET_MB_SHIFT = 20
+
 BAT_REGION_GUID = UUID("2DC27766-F623-4200-9D64-115E9BFD4A08")
 FILE_PARAMETERS_GUID = UUID("CAA16737-FA36-4D43-B3B6-33F0AA44E76B")
 LOGICAL_SECTOR_SIZE_GUID = UUID("8141BF1D-A96F-4709-BA47-F233A8FAAB5F")
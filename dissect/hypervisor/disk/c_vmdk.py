@@ -142,3 +142,8 @@ COWD_MAGIC = b"COWD"
 VMDK_MAGIC = b"KDMV"
 # Technically a 8 byte header, but it's little endian so everything after the first 4 bytes is 0
 SESPARSE_MAGIC = struct.pack("<I", c_vmdk.SESPARSE_CONST_HEADER_MAGIC)
+
+# Compressed grain headers are parsed on every compressed grain read, so use precompiled structs for those
+# Equivalent to SparseGrainLBAHeaderOnDisk (lba, cmp_size) and a plain uint32 cmp_size respectively
+GRAIN_LBA_HEADER = struct.Struct("<QI")
+GRAIN_SIZE_HEADER = struct.Struct("<I")
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import array
+import sys
 from bisect import bisect_right
-from dataclasses import dataclass
-from functools import cached_property
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
 from pathlib import Path
 from typing import TYPE_CHECKING, BinaryIO
 from uuid import UUID
@@ -12,6 +14,7 @@ from dissect.util.stream import AlignedStream
 
 from dissect.hypervisor.disk.c_hdd import SECTOR_SIZE, c_hdd
 from dissect.hypervisor.exceptions import InvalidHeaderError
+from dissect.hypervisor.util.fileio import readinto_at, readinto_exact_at
 
 if TYPE_CHECKING:
     from collections.abc import Iterator
@@ -21,6 +24,12 @@ DEFAULT_TOP_GUID = UUID("{5fbaabe3-6958-40ff-92a7-860e329aab41}")
 NULL_GUID = UUID("00000000-0000-0000-0000-000000000000")
 
 
+@lru_cache(maxsize=1024)
+def _uuid(value: str) -> UUID:
+    """Parse a GUID string, caching recent results since the same GUIDs are referenced throughout a descriptor."""
+    return UUID(value)
+
+
 class HDD:
     """Parallels HDD virtual disk implementation.
 
@@ -88,7 +97,7 @@ class HDD:
             guid: The snapshot GUID to open.
         """
         if guid and not isinstance(guid, UUID):
-            guid = UUID(guid)
+            guid = _uuid(guid)
 
         if guid is None:
             guid = self.descriptor.snapshots.top_guid or DEFAULT_TOP_GUID
@@ -127,28 +136,45 @@ class Descriptor:
     def __init__(self, path: Path):
         self.path = path
 
-        self.xml: Element = ElementTree.fromstring(path.read_text())
+        with path.open("rb") as fh:
+            self.xml: Element = ElementTree.parse(fh).getroot()
         self.storage_data = StorageData.from_xml(self.xml.find("StorageData"))
         self.snapshots = Snapshots.from_xml(self.xml.find("Snapshots"))
 
+        self._chain_cache: dict[UUID, tuple[UUID, ...]] = {}
+
     def get_snapshot_chain(self, guid: UUID) -> list[UUID]:
         """Return the snapshot chain for a given snapshot GUID.
 
         Args:
             guid: The snapshot GUID to return a chain for.
         """
-        shot = self.snapshots.find_shot(guid)
+        # Walk up the snapshot tree until we reach the root or a snapshot with an already known chain
+        pending = []
+        chain = ()
+        while True:
+            if (cached := self._chain_cache.get(guid)) is not None:
+                chain = cached
+                break
+
+            shot = self.snapshots.find_shot(guid)
+            pending.append(shot.guid)
+
+            if shot.parent == NULL_GUID:
+                break
+            guid = shot.parent
 
-        chain = [shot.guid]
-        while shot.parent != NULL_GUID:
-            shot = self.snapshots.find_shot(shot.parent)
-            chain.append(shot.guid)
+        # Every snapshot we passed shares the tail of its chain with its parent, so cache those too
+        for shot_guid in reversed(pending):
+            chain = self._chain_cache[shot_guid] = (shot_guid, *chain)
 
-        return chain
+        return list(chain)
 
 
 @dataclass
 class XMLEntry:
+    __slots__ = ()
+
     @classmethod
     def from_xml(cls, element: Element) -> XMLEntry:
         if element.tag != cls.__name__:
@@ -162,6 +188,8 @@ class XMLEntry:
 
 @dataclass
 class StorageData(XMLEntry):
+    __slots__ = ("storages",)
+
     storages: list[Storage]
 
     @classmethod
@@ -174,6 +202,10 @@ class Storage(XMLEntry):
     start: int
     end: int
     images: list[Image]
+    _image_lookup: dict[UUID, Image] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._image_lookup = {image.guid: image for image in self.images}
 
     @classmethod
     def _from_xml(cls, element: Element) -> Storage:
@@ -192,15 +224,16 @@ class Storage(XMLEntry):
         Raises:
             KeyError: If the GUID could not be found.
         """
-        for image in self.images:
-            if image.guid == guid:
-                return image
-
-        raise KeyError(f"Image GUID not found: {guid}")
+        try:
+            return self._image_lookup[guid]
+        except KeyError:
+            raise KeyError(f"Image GUID not found: {guid}")
 
 
 @dataclass
 class Image(XMLEntry):
+    __slots__ = ("file", "guid", "type")
+
     guid: UUID
     type: str
     file: str
@@ -208,7 +241,7 @@ class Image(XMLEntry):
     @classmethod
     def _from_xml(cls, element: Element) -> Image:
         return cls(
-            UUID(element.find("GUID").text),
+            _uuid(element.find("GUID").text),
             element.find("Type").text,
             element.find("File").text,
         )
@@ -218,12 +251,16 @@ class Image(XMLEntry):
 class Snapshots(XMLEntry):
     top_guid: UUID | None
     shots: list[Shot]
+    _shot_lookup: dict[UUID, Shot] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._shot_lookup = {shot.guid: shot for shot in self.shots}
 
     @classmethod
     def _from_xml(cls, element: Element) -> Snapshots:
         top_guid = element.find("TopGUID")
-        if top_guid:
-            top_guid = UUID(top_guid.text)
+        if top_guid is not None:
+            top_guid = _uuid(top_guid.text)
         shots = list(map(Shot.from_xml, element.iterfind("Shot")))
 
         return cls(top_guid, shots)
@@ -237,23 +274,24 @@ class Snapshots(XMLEntry):
         Raises:
             KeyError: If the GUID could not be found.
         """
-        for shot in self.shots:
-            if shot.guid == guid:
-                return shot
-
-        raise KeyError(f"Shot GUID not found: {guid}")
+        try:
+            return self._shot_lookup[guid]
+        except KeyError:
+            raise KeyError(f"Shot GUID not found: {guid}")
 
 
 @dataclass
 class Shot(XMLEntry):
+    __slots__ = ("guid", "parent")
+
     guid: UUID
     parent: UUID
 
     @classmethod
     def _from_xml(cls, element: Element) -> Shot:
         return cls(
-            UUID(element.find("GUID").text),
-            UUID(element.find("ParentGUID").text),
+            _uuid(element.find("GUID").text),
+            _uuid(element.find("ParentGUID").text),
         )
 
 
@@ -279,22 +317,27 @@ class StorageStream(AlignedStream):
         super().__init__(size * SECTOR_SIZE)
 
     def _read(self, offset: int, length: int) -> bytes:
-        sector = offset // SECTOR_SIZE
-        count = (length + SECTOR_SIZE - 1) // SECTOR_SIZE
+        stream_idx = bisect_right(self._lookup, offset // SECTOR_SIZE) - 1
 
-        result = []
-        stream_idx = bisect_right(self._lookup, sector) - 1
+        storage, stream = self.streams[stream_idx]
+        if offset + length <= storage.end * SECTOR_SIZE:
+            # Fast path for reads that fit entirely within a single stream
+            stream.seek(offset - storage.start * SECTOR_SIZE)
+            return stream.read(length)
 
-        while count > 0 and stream_idx < len(self.streams):
-            storage, stream = self.streams[stream_idx]
-            sectors_remaining = storage.end - sector
-            read_sectors = min(sectors_remaining, count)
+        streams = self.streams
+        num_streams = len(streams)
 
-            stream.seek((sector - storage.start) * SECTOR_SIZE)
-            result.append(stream.read(read_sectors * SECTOR_SIZE))
+        result = []
+        while length > 0 and stream_idx < num_streams:
+            storage, stream = streams[stream_idx]
+            read_size = min(storage.end * SECTOR_SIZE - offset, length)
+
+            stream.seek(offset - storage.start * SECTOR_SIZE)
+            result.append(stream.read(read_size))
 
-            sector += read_sectors
-            count -= read_sectors
+            offset += read_size
+            length -= read_size
             stream_idx += 1
 
         return b"".join(result)
@@ -335,30 +378,72 @@ class HDS(AlignedStream):
         super().__init__(size * SECTOR_SIZE)
 
     @cached_property
-    def bat(self) -> list[int]:
+    def bat(self) -> array.array[int]:
         """Return the block allocation table (BAT)."""
-        self.fh.seek(len(c_hdd.pvd_header))
-        return c_hdd.uint32[self.header.m_Size](self.fh)
+        # Read directly into the array buffer to avoid an intermediate copy of what can be a large table
+        bat = array.array("I", [0]) * self.header.m_Size
+        readinto_exact_at(self.fh, None, memoryview(bat).cast("B"), len(c_hdd.pvd_header))
+        if sys.byteorder == "big":
+            bat.byteswap()
+        return bat
 
     def _read(self, offset: int, length: int) -> bytes:
-        result = []
+        buf = bytearray(length)
+        view = memoryview(buf)
+
+        runs = list(self._iter_runs(offset, length))
+        # Whether all sparse runs have already been read from the parent in one go
+        parent_read = self.parent is not None and self._read_parent_runs(offset, runs, view)
 
-        for read_offset, read_size in self._iter_runs(offset, length):
+        pos = 0
+        for read_offset, read_size in runs:
             # Sentinel value for sparse runs
+            # Sparse runs without a parent are left as is, the buffer is already zero initialized
+            # So is anything past the end of a (smaller) parent
             if read_offset is None:
-                if self.parent:
-                    self.parent.seek(offset)
-                    result.append(self.parent.read(read_size))
-                else:
-                    result.append(b"\x00" * read_size)
+                if self.parent and not parent_read:
+                    readinto_at(self.parent, None, view[pos : pos + read_size], offset + pos)
             else:
-                self.fh.seek(read_offset)
-                result.append(self.fh.read(read_size))
+                readinto_exact_at(self.fh, None, view[pos : pos + read_size], read_offset)
 
-            offset += read_size
-            length -= read_size
+            pos += read_size
 
-        return b"".join(result)
+        return bytes(view[:pos])
+
+    def _read_parent_runs(self, offset: int, runs: list[tuple[int | None, int]], view: memoryview) -> bool:
+        """Read all sparse runs from the parent with a single read if the runs are mostly sparse.
+
+        Every parent read may recurse down the snapshot chain, so if the sparse runs make up at least half
+        of the range they span, it's cheaper to read that entire range from the parent at once and let the
+        allocated runs overwrite their part of it afterwards.
+
+        Args:
+            offset: The offset in bytes the runs start at.
+            runs: The runs as generated by :meth:`_iter_runs`.
+            view: The buffer to read into, starting at ``offset``.
+
+        Returns:
+            Whether the sparse runs were read from the parent.
+        """
+        start = end = None
+        sparse_size = 0
+        num_sparse = 0
+
+        pos = 0
+        for read_offset, read_size in runs:
+            if read_offset is None:
+                if start is None:
+                    start = pos
+                end = pos + read_size
+                sparse_size += read_size
+                num_sparse += 1
+            pos += read_size
+
+        if num_sparse < 2 or sparse_size * 2 < end - start:
+            return False
+
+        readinto_at(self.parent, None, view[start:end], offset + start)
+        return True
 
     def _iter_runs(self, offset: int, length: int) -> Iterator[tuple[int, int]]:
         """Iterate optimized read runs for a given offset and read length.
@@ -368,24 +453,31 @@ class HDS(AlignedStream):
             length: The length in bytes to generate runs for.
         """
         bat = self.bat
+        cluster_size = self.cluster_size
+        # Size of a unit of BAT entry in bytes
+        bat_unit_size = self._bat_multiplier * SECTOR_SIZE
 
         run_offset = None
         run_size = 0
 
-        while offset < self.size and length > 0:
-            cluster_idx, offset_in_cluster = divmod(offset, self.cluster_size)
-            read_size = min(self.cluster_size - offset_in_cluster, length)
+        # Only the first cluster can be read from at an offset, all following clusters are read from the start
+        # So we only need to calculate the cluster index and offset once and can walk the BAT from there
+        length = min(length, self.size - offset)
+        cluster_idx, offset_in_cluster = divmod(offset, cluster_size)
+
+        while length > 0:
+            read_size = min(cluster_size - offset_in_cluster, length)
 
             bat_entry = bat[cluster_idx]
             # BAT entry of 0 means either a sparse or a parent read
             # Use 0 to denote a sparse run for now to make calculations easier
-            read_offset = 0 if bat_entry == 0 else bat_entry * self._bat_multiplier * SECTOR_SIZE + offset_in_cluster
+            read_offset = 0 if bat_entry == 0 else bat_entry * bat_unit_size + offset_in_cluster
 
             if run_offset is None:
                 # First iteration
                 run_offset = read_offset
                 run_size = read_size
-            elif (read_offset == run_offset + run_size) or (run_offset, read_offset) == (0, 0):
+            elif (run_offset and read_offset == run_offset + run_size) or (not run_offset and not read_offset):
                 # Consecutive (sparse) clusters
                 run_size += read_size
             else:
@@ -397,8 +489,9 @@ class HDS(AlignedStream):
                 run_offset = read_offset
                 run_size = read_size
 
-            offset += read_size
             length -= read_size
+            cluster_idx += 1
+            offset_in_cluster = 0
 
         if run_offset is not None:
             # Flush remaining run
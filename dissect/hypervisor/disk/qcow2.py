@@ -3,15 +3,17 @@
 # - https://github.com/qemu/qemu/blob/master/docs/interop/qcow2.txt
 from __future__ import annotations
 
-import copy
+import array
+import os
+import sys
 import zlib
 from functools import cached_property, lru_cache
-from io import BytesIO
-from typing import TYPE_CHECKING, BinaryIO
+from typing import TYPE_CHECKING, BinaryIO, ClassVar
 
 from dissect.util.stream import AlignedStream
 
 from dissect.hypervisor.disk.c_qcow2 import (
+    CLUSTER_TO_SUBCLUSTER_TYPE,
     NORMAL_SUBCLUSTER_TYPES,
     QCOW2_MAGIC,
     UNALLOCATED_SUBCLUSTER_TYPES,
@@ -19,12 +21,15 @@ from dissect.hypervisor.disk.c_qcow2 import (
     QCow2ClusterType,
     QCow2SubclusterType,
     c_qcow2,
+    cto,
     ctz,
 )
 from dissect.hypervisor.exceptions import Error, InvalidHeaderError
+from dissect.hypervisor.util.fileio import preadv_fileno, readinto_at, readinto_exact_at
+from dissect.hypervisor.util.readahead import SequentialReadahead, fileno
 
 if TYPE_CHECKING:
-    from collections.abc import Iterator
+    from collections.abc import Callable, Iterator
 
 try:
     import zstandard as zstd
@@ -33,9 +38,50 @@ try:
 except ImportError:
     HAS_ZSTD = False
 
+try:
+    import deflate
+
+    HAS_DEFLATE = True
+except ImportError:
+    HAS_DEFLATE = False
+
 
 ALLOW_NO_BACKING_FILE = 1
 
+# Masks and flags used in the run and cluster type dispatch, looked up from c_qcow2 only once
+L1E_OFFSET_MASK = c_qcow2.L1E_OFFSET_MASK
+L2E_OFFSET_MASK = c_qcow2.L2E_OFFSET_MASK
+L2E_COMPRESSED_OFFSET_SIZE_MASK = c_qcow2.L2E_COMPRESSED_OFFSET_SIZE_MASK
+QCOW_OFLAG_COPIED = c_qcow2.QCOW_OFLAG_COPIED
+QCOW_OFLAG_COMPRESSED = c_qcow2.QCOW_OFLAG_COMPRESSED
+QCOW_OFLAG_ZERO = c_qcow2.QCOW_OFLAG_ZERO
+
+# Cluster and subcluster types, bound to module level names so the type dispatch doesn't need attribute lookups
+QCOW2_CLUSTER_UNALLOCATED = QCow2ClusterType.QCOW2_CLUSTER_UNALLOCATED
+QCOW2_CLUSTER_ZERO_PLAIN = QCow2ClusterType.QCOW2_CLUSTER_ZERO_PLAIN
+QCOW2_CLUSTER_ZERO_ALLOC = QCow2ClusterType.QCOW2_CLUSTER_ZERO_ALLOC
+QCOW2_CLUSTER_NORMAL = QCow2ClusterType.QCOW2_CLUSTER_NORMAL
+QCOW2_CLUSTER_COMPRESSED = QCow2ClusterType.QCOW2_CLUSTER_COMPRESSED
+
+QCOW2_SUBCLUSTER_NORMAL = QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL
+QCOW2_SUBCLUSTER_COMPRESSED = QCow2SubclusterType.QCOW2_SUBCLUSTER_COMPRESSED
+QCOW2_SUBCLUSTER_ZERO_PLAIN = QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_PLAIN
+QCOW2_SUBCLUSTER_ZERO_ALLOC = QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_ALLOC
+QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN = QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN
+QCOW2_SUBCLUSTER_UNALLOCATED_ALLOC = QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_ALLOC
+QCOW2_SUBCLUSTER_INVALID = QCow2SubclusterType.QCOW2_SUBCLUSTER_INVALID
+
+# Distinct subcluster range type results, shared by all L2Table range type caches
+_RANGE_TYPES = {}
+
+# By default, cache every L2 table if all of them together take up at most this many bytes
+L2_CACHE_ALL_MAX_SIZE = 64 * 1024 * 1024
+# Otherwise, cache up to this many L2 tables by default
+L2_CACHE_SIZE = 1024
+
+# Subcluster bitmap of a cluster with all subclusters allocated and none of them reading as zero
+L2_BITMAP_ALL_ALLOC = (1 << 32) - 1
+
 
 class QCow2(AlignedStream):
     """QCOW2 virtual disk implementation.
@@ -47,10 +93,24 @@ class QCow2(AlignedStream):
 
     A backing-file can optionally be skipped if `qcow2.ALLOW_NO_BACKING_FILE` is passed
     as the `backing_file` argument. In this case, any reads from a backing file will result
-    in all null bytes being read.
+    in all null bytes being read. Likewise, anything past the end of a backing file reads as null bytes.
+
+    Parsed L2 tables are cached, up to `l2_cache_size` tables. Every table takes up a cluster worth
+    of memory, so a larger cache trades memory for fewer metadata reads on large disks. If no
+    `l2_cache_size` is given, images whose L2 tables fit in `L2_CACHE_ALL_MAX_SIZE` bytes have all
+    their L2 tables cached, and other images up to `L2_CACHE_SIZE` tables.
+
+    Zlib compressed clusters are decompressed with libdeflate if the optional `deflate` module is
+    available, which is considerably faster than the standard library `zlib` module.
     """
 
-    def __init__(self, fh: BinaryIO, data_file: BinaryIO | None = None, backing_file: BinaryIO | int | None = None):
+    def __init__(
+        self,
+        fh: BinaryIO,
+        data_file: BinaryIO | None = None,
+        backing_file: BinaryIO | int | None = None,
+        l2_cache_size: int | None = None,
+    ):
         self.fh = fh
 
         self.header = c_qcow2.QCowHeader(fh)
@@ -73,14 +133,28 @@ class QCow2(AlignedStream):
         self.l2_bits = self.cluster_bits - ctz(self._l2_entry_size, 32)
         self.l2_size = 1 << self.l2_bits
 
+        # Precomputed masks and shifts for translating guest offsets into table indices
+        self._cluster_mask = self.cluster_size - 1
+        self._subcluster_mask = self.subcluster_size - 1
+        self._l1_shift = self.l2_bits + self.cluster_bits
+        self._l2_mask = self.l2_size - 1
+        self._sc_per_cluster_mask = self.subclusters_per_cluster - 1
+
         # 104 = byte offset of compression_type
         if self.header.header_length > 104:
             self.compression_type = self.header.compression_type
         else:
             self.compression_type = c_qcow2.QCOW2_COMPRESSION_TYPE_ZLIB
 
-        if self.compression_type == c_qcow2.QCOW2_COMPRESSION_TYPE_ZSTD and not HAS_ZSTD:
-            raise RuntimeError("zstandard module not available")
+        # Pick the decompression routine once, the compression type is fixed for the whole image
+        self._zstd = None
+        if self.compression_type == c_qcow2.QCOW2_COMPRESSION_TYPE_ZLIB:
+            self._decompress = self._decompress_zlib
+        elif self.compression_type == c_qcow2.QCOW2_COMPRESSION_TYPE_ZSTD:
+            if not HAS_ZSTD:
+                raise RuntimeError("zstandard module not available")
+            self._zstd = zstd.ZstdDecompressor()
+            self._decompress = self._decompress_zstd
 
         self.csize_shift = 62 - (self.cluster_bits - 8)
         self.csize_mask = (1 << (self.cluster_bits - 8)) - 1
@@ -121,7 +195,32 @@ class QCow2(AlignedStream):
             if backing_file != ALLOW_NO_BACKING_FILE:
                 self.backing_file = backing_file
 
-        self.l2_table = lru_cache(128)(self.l2_table)
+        if l2_cache_size is None:
+            all_fit = self.header.l1_size << self.cluster_bits <= L2_CACHE_ALL_MAX_SIZE
+            l2_cache_size = self.header.l1_size if all_fit else L2_CACHE_SIZE
+        # Every L1 entry references at most one L2 table, so there's no use in caching more tables than that
+        self.l2_table = lru_cache(min(l2_cache_size, self.header.l1_size))(self.l2_table)
+        # Scratch buffer for compressed cluster data, allocated on first use
+        self._compressed_buf = None
+        # Compressed clusters are immutable, so keep up to 64 MiB of recently decompressed clusters around
+        # to avoid decompressing the same cluster over and over again for small reads
+        self._read_compressed_cluster = lru_cache(max(1, (64 * 1024 * 1024) >> self.cluster_bits))(
+            self._read_compressed_cluster
+        )
+        # File descriptor for read-ahead hints, only available if the image is backed by an OS level file
+        self._fd = fileno(fh)
+        # Guest data is read from the data file, ask for more read-ahead there while reads are sequential
+        self._readahead = SequentialReadahead(self.data_file)
+        # Read guest data with a single positional read call if the data file is an OS level file
+        self._data_fd = preadv_fileno(self.data_file)
+        self._prefetch_l1_index = None
+        # Without subclusters there's no bitmap to consider, so use specialized subcluster type lookups
+        if self.has_subclusters:
+            self._get_subcluster_type = get_subcluster_type
+            self._get_subcluster_range_type = get_subcluster_range_type
+        else:
+            self._get_subcluster_type = _get_subcluster_type_no_subclusters
+            self._get_subcluster_range_type = _get_subcluster_range_type_no_subclusters
 
         super().__init__(self.header.size)
 
@@ -141,23 +240,40 @@ class QCow2(AlignedStream):
             if ext.magic == c_qcow2.QCOW2_EXT_MAGIC_END:
                 break
 
-            if ext.magic == c_qcow2.QCOW2_EXT_MAGIC_BACKING_FORMAT:
-                self.backing_format = self.fh.read(ext.len).decode().upper()
-                self.image_backing_format = self.backing_format.upper()
-            elif ext.magic == c_qcow2.QCOW2_EXT_MAGIC_FEATURE_TABLE:
-                self.feature_table = self.fh.read(ext.len)
-            elif ext.magic == c_qcow2.QCOW2_EXT_MAGIC_CRYPTO_HEADER:
-                self.crypto_header = c_qcow2.Qcow2CryptoHeaderExtension(self.fh)
-            elif ext.magic == c_qcow2.QCOW2_EXT_MAGIC_BITMAPS:
-                self.bitmap_header = c_qcow2.Qcow2BitmapHeaderExt(self.fh)
-            elif ext.magic == c_qcow2.QCOW2_EXT_MAGIC_DATA_FILE:
-                self.image_data_file = self.fh.read(ext.len).decode()
+            handler = self._extension_handlers.get(ext.magic)
+            if handler is not None:
+                handler(self, ext)
             else:
                 self.unknown_extensions.append((ext, self.fh.read(ext.len)))
 
             # Align to nearest 8 byte boundary
             offset += (ext.len + 7) & 0xFFFFFFF8
 
+    def _read_backing_format_extension(self, ext: c_qcow2.QCowExtension) -> None:
+        self.backing_format = self.fh.read(ext.len).decode().upper()
+        self.image_backing_format = self.backing_format.upper()
+
+    def _read_feature_table_extension(self, ext: c_qcow2.QCowExtension) -> None:
+        self.feature_table = self.fh.read(ext.len)
+
+    def _read_crypto_header_extension(self, ext: c_qcow2.QCowExtension) -> None:
+        self.crypto_header = c_qcow2.Qcow2CryptoHeaderExtension(self.fh)
+
+    def _read_bitmaps_extension(self, ext: c_qcow2.QCowExtension) -> None:
+        self.bitmap_header = c_qcow2.Qcow2BitmapHeaderExt(self.fh)
+
+    def _read_data_file_extension(self, ext: c_qcow2.QCowExtension) -> None:
+        self.image_data_file = self.fh.read(ext.len).decode()
+
+    # Header extension magic to the method that parses that extension, anything not in here is kept as is
+    _extension_handlers: ClassVar[dict[int, Callable[[QCow2, c_qcow2.QCowExtension], None]]] = {
+        c_qcow2.QCOW2_EXT_MAGIC_BACKING_FORMAT: _read_backing_format_extension,
+        c_qcow2.QCOW2_EXT_MAGIC_FEATURE_TABLE: _read_feature_table_extension,
+        c_qcow2.QCOW2_EXT_MAGIC_CRYPTO_HEADER: _read_crypto_header_extension,
+        c_qcow2.QCOW2_EXT_MAGIC_BITMAPS: _read_bitmaps_extension,
+        c_qcow2.QCOW2_EXT_MAGIC_DATA_FILE: _read_data_file_extension,
+    }
+
     @cached_property
     def snapshots(self) -> list[QCow2Snapshot]:
         snapshots = []
@@ -170,14 +286,36 @@ class QCow2(AlignedStream):
         return snapshots
 
     @cached_property
-    def l1_table(self) -> list[int]:
+    def l1_table(self) -> array.array[int]:
         # L1 table is usually relatively small, it can be at most 32MB on PB or EB size disks
-        self.fh.seek(self.header.l1_table_offset)
-        return c_qcow2.uint64[self.header.l1_size](self.fh)
+        return self._read_table(self.header.l1_table_offset, self.header.l1_size)
+
+    @cached_property
+    def _l2_offsets(self) -> array.array[int]:
+        """The L2 table offsets of the L1 table, with the flag bits already masked off."""
+        return array.array("Q", [entry & L1E_OFFSET_MASK for entry in self.l1_table])
 
     def l2_table(self, l2_offset: int) -> L2Table:
         return L2Table(self, l2_offset)
 
+    def _clone_with_l1(self, l1_table: array.array[int]) -> QCow2:
+        """Return a view of this disk that uses a different L1 table, e.g. the one of a snapshot.
+
+        The view shares the file handles and the L2 table and decompressed cluster caches with this disk.
+        Those are keyed by host offset, so they remain valid regardless of the L1 table that references them.
+        The read-ahead state is shared too, since the hints apply to the file rather than to a view of it.
+        Interleaved reads from both views then count as random access, which is what the file gets to see.
+        """
+        cls = type(self)
+        disk = cls.__new__(cls)
+        disk.__dict__.update(self.__dict__)
+        disk.__dict__.pop("_l2_offsets", None)
+        disk.l1_table = l1_table
+        disk._prefetch_l1_index = None
+        # Start with a fresh stream state, so we don't serve data that was buffered for this disk
+        AlignedStream.__init__(disk, self.size)
+        return disk
+
     @property
     def has_backing_file(self) -> bool:
         return self.backing_file is not None
@@ -191,113 +329,211 @@ class QCow2(AlignedStream):
         return bool(self.header.incompatible_features & c_qcow2.QCOW2_INCOMPAT_EXTL2)
 
     def _read(self, offset: int, length: int) -> bytes:
-        result = []
+        # Aligned reads can extend past the end of the disk, there's nothing to translate there
+        length = min(length, self.size - offset)
+        if length <= 0:
+            return b""
+
+        self._readahead.update(offset, length)
+
+        result = bytearray(length)
+        view = memoryview(result)
+        pos = 0
+
+        # Zero runs need no work, the buffer is already zero filled
+        for sc_type, read_offset, run_offset, run_length in self._yield_reads(offset, length):
+            if sc_type == QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN:
+                # A backing file may be smaller than this image, anything past its end reads as zeroes
+                readinto_at(self.backing_file, None, view[pos : pos + run_length], read_offset)
+            elif sc_type == QCOW2_SUBCLUSTER_COMPRESSED:
+                buf = self._read_compressed(run_offset, read_offset, run_length)
+                view[pos : pos + len(buf)] = buf
+            elif sc_type == QCOW2_SUBCLUSTER_NORMAL:
+                readinto_exact_at(self.data_file, self._data_fd, view[pos : pos + run_length], run_offset)
+
+            pos += run_length
+
+        return bytes(result)
+
+    def _yield_reads(self, offset: int, length: int) -> Iterator[tuple[QCow2SubclusterType, int, int, int]]:
+        """Merge consecutive runs from :meth:`_yield_runs` that can be served by a single read.
+
+        Zero runs (including unallocated runs without a backing file) are normalized to ``QCOW2_SUBCLUSTER_ZERO_PLAIN``
+        and unallocated runs with a backing file to ``QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN``. Normal runs are only merged
+        if they are contiguous in the data file. Compressed runs are never merged.
+        """
+        has_backing_file = self.has_backing_file
+        pending = None
 
         for sc_type, read_offset, run_offset, run_length in self._yield_runs(offset, length):
-            unalloc_zeroed = sc_type in UNALLOCATED_SUBCLUSTER_TYPES and not self.has_backing_file
-
-            if sc_type in ZERO_SUBCLUSTER_TYPES or unalloc_zeroed:
-                result.append(b"\x00" * run_length)
-            elif sc_type in UNALLOCATED_SUBCLUSTER_TYPES and self.has_backing_file:
-                self.backing_file.seek(read_offset)
-                result.append(self.backing_file.read(run_length))
-            elif sc_type == QCow2SubclusterType.QCOW2_SUBCLUSTER_COMPRESSED:
-                result.append(self._read_compressed(run_offset, read_offset, run_length))
-            elif sc_type == QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL:
-                self.data_file.seek(run_offset)
-                result.append(self.data_file.read(run_length))
-
-        return b"".join(result)
-
-    def _read_compressed(self, cluster_descriptor: int, offset: int, length: int) -> bytes:
-        offset_in_cluster = offset_into_cluster(self, offset)
+            if sc_type in ZERO_SUBCLUSTER_TYPES or (sc_type in UNALLOCATED_SUBCLUSTER_TYPES and not has_backing_file):
+                sc_type = QCOW2_SUBCLUSTER_ZERO_PLAIN
+            elif sc_type in UNALLOCATED_SUBCLUSTER_TYPES:
+                sc_type = QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN
+
+            if (
+                pending is not None
+                and pending[0] == sc_type
+                and sc_type != QCOW2_SUBCLUSTER_COMPRESSED
+                and (sc_type != QCOW2_SUBCLUSTER_NORMAL or pending[2] + pending[3] == run_offset)
+            ):
+                pending = (sc_type, pending[1], pending[2], pending[3] + run_length)
+                continue
+
+            if pending is not None:
+                yield pending
+            pending = (sc_type, read_offset, run_offset, run_length)
+
+        if pending is not None:
+            yield pending
+
+    def _prefetch_l2_table(self, l1_index: int) -> None:
+        """Hint the OS to start reading the L2 table of the given L1 index in the background.
+
+        Sequential reads will need that table next, so by the time we get there it's hopefully in the page cache.
+        """
+        l2_offsets = self._l2_offsets
+        if l1_index >= len(l2_offsets) or not (l2_offset := l2_offsets[l1_index]):
+            return
+
+        try:
+            os.posix_fadvise(self._fd, l2_offset, self.cluster_size, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            # Not supported for this file, don't bother trying again
+            self._fd = None
+
+    def _read_table(self, offset: int, count: int) -> array.array[int]:
+        """Read a table of ``count`` big endian 64-bit integers at ``offset`` in the image file."""
+        self.fh.seek(offset)
+        return _unpack_table(self.fh.read(count * 8))
+
+    def _read_compressed(self, cluster_descriptor: int, offset: int, length: int) -> memoryview:
+        offset_in_cluster = offset & self._cluster_mask
+        decompressed = self._read_compressed_cluster(cluster_descriptor)
+        # Slice through a memoryview so the caller copies straight out of the cached cluster
+        return memoryview(decompressed)[offset_in_cluster : offset_in_cluster + length]
+
+    def _read_compressed_cluster(self, cluster_descriptor: int) -> bytes:
         coffset = cluster_descriptor & self.cluster_offset_mask
         nb_csectors = ((cluster_descriptor >> self.csize_shift) & self.csize_mask) + 1
         # Original source uses the mask ~(~(QCOW2_COMPRESSED_SECTOR_SIZE - 1ULL))
         # However bit inversion is weird in Python, and this evaluates to 511, so we use that value instead.
         csize = nb_csectors * c_qcow2.QCOW2_COMPRESSED_SECTOR_SIZE - (coffset & 511)
 
-        self.fh.seek(coffset)
-        buf = self.fh.read(csize)
-        decompressed = self._decompress(buf)
+        if self._compressed_buf is None:
+            # Large enough for the biggest compressed size that can be encoded in a cluster descriptor
+            self._compressed_buf = bytearray((self.csize_mask + 1) * c_qcow2.QCOW2_COMPRESSED_SECTOR_SIZE)
 
-        return decompressed[offset_in_cluster : offset_in_cluster + length]
+        buf = memoryview(self._compressed_buf)[:csize]
+        return self._decompress(buf[: readinto_at(self.fh, None, buf, coffset)])
 
-    def _decompress(self, buf: bytes) -> bytes:
+    def _decompress(self, buf: bytes | memoryview) -> bytes:
         if self.compression_type == c_qcow2.QCOW2_COMPRESSION_TYPE_ZLIB:
-            dctx = zlib.decompressobj(-12)
-            return dctx.decompress(buf, self.cluster_size)
+            return self._decompress_zlib(buf)
 
         if self.compression_type == c_qcow2.QCOW2_COMPRESSION_TYPE_ZSTD:
-            result = []
-
-            dctx = zstd.ZstdDecompressor()
-            reader = dctx.stream_reader(BytesIO(buf))
-            while reader.tell() < self.cluster_size:
-                chunk = reader.read(self.cluster_size - reader.tell())
-                if not chunk:
-                    break
-                result.append(chunk)
-            return b"".join(result)
+            return self._decompress_zstd(buf)
 
         raise Error(f"Invalid compression type: {self.compression_type}")
 
+    def _decompress_zlib(self, buf: bytes | memoryview) -> bytes:
+        if HAS_DEFLATE:
+            try:
+                # Compressed clusters are raw deflate streams that always decompress to a full cluster
+                return deflate.deflate_decompress(buf, self.cluster_size)
+            except deflate.DeflateError:
+                # libdeflate is strict about the output size, let zlib deal with anything out of the ordinary
+                pass
+
+        try:
+            return zlib.decompress(buf, -12, self.cluster_size)
+        except zlib.error:
+            # Truncated or damaged stream, salvage as much as possible
+            return zlib.decompressobj(-12).decompress(buf, self.cluster_size)
+
+    def _decompress_zstd(self, buf: bytes | memoryview) -> bytes:
+        # Compressed clusters don't store the content size in the frame header, so pass the cluster size
+        return self._zstd.decompress(buf, max_output_size=self.cluster_size)
+
     def _yield_runs(self, offset: int, length: int) -> Iterator[tuple[QCow2SubclusterType, int, int, int]]:
         # reference: qcow2_get_host_offset
+        if offset >= self.size:
+            return
+
+        # These are constant for the lifetime of the image, so look them up only once
+        l2_offsets = self._l2_offsets
+        l1_size = len(l2_offsets)
+        l2_table_fn = self.l2_table
+        subcluster_type = self._get_subcluster_type
+        l2_size = self.l2_size
+        cluster_bits = self.cluster_bits
+        cluster_mask = self._cluster_mask
+        subcluster_bits = self.subcluster_bits
+        l1_shift = self._l1_shift
+        l2_mask = self._l2_mask
+        sc_mask = self._sc_per_cluster_mask
+        unallocated_plain = QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN
+        compressed = QCOW2_SUBCLUSTER_COMPRESSED
+
         while length > 0:
-            sc_type = None
             host_offset = 0
-            read_count = 0
 
-            l1_index = offset_to_l1_index(self, offset)
-            l2_index = offset_to_l2_index(self, offset)
-            sc_index = offset_to_sc_index(self, offset)
+            l1_index = offset >> l1_shift
+            l2_index = (offset >> cluster_bits) & l2_mask
+            sc_index = (offset >> subcluster_bits) & sc_mask
 
-            offset_in_cluster = offset_into_cluster(self, offset)
+            offset_in_cluster = offset & cluster_mask
 
             bytes_needed = length + offset_in_cluster
             # at the time being we just use the entire l2 table and not cached slices
             # this is actually the bytes available/remaining in this l2 table
-            bytes_available = (self.l2_size - l2_index) << self.cluster_bits
+            bytes_available = (l2_size - l2_index) << cluster_bits
             bytes_needed = min(bytes_needed, bytes_available)
 
-            if l1_index > self.header.l1_size:
+            if l1_index >= l1_size:
                 # bytes_needed is already the smaller value here
                 read_count = bytes_needed - offset_in_cluster
 
-                yield (QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN, offset, host_offset, read_count)
+                yield (unallocated_plain, offset, host_offset, read_count)
 
                 length -= read_count
                 offset += read_count
                 continue
 
-            l2_offset = self.l1_table[l1_index] & c_qcow2.L1E_OFFSET_MASK
+            l2_offset = l2_offsets[l1_index]
             if not l2_offset:
                 # bytes_needed is already the smaller value here
                 read_count = bytes_needed - offset_in_cluster
 
-                yield (QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN, offset, host_offset, read_count)
+                yield (unallocated_plain, offset, host_offset, read_count)
 
                 length -= read_count
                 offset += read_count
                 continue
 
-            l2_table = self.l2_table(l2_offset)
-            l2_entry = l2_table.entry(l2_index)
-            l2_bitmap = l2_table.bitmap(l2_index)
+            if self._fd is not None and l1_index != self._prefetch_l1_index:
+                self._prefetch_l2_table(l1_index + 1)
+                self._prefetch_l1_index = l1_index
 
-            sc_type = get_subcluster_type(self, l2_entry, l2_bitmap, sc_index)
+            l2_table = l2_table_fn(l2_offset)
+            # Index the table directly, this is the same as l2_table.entry()
+            l2_entry = l2_table._entries[l2_index]
+            if l2_table._range_types is None:
+                # No subclusters, classifying the entry is cheaper than going through the table
+                sc_type = subcluster_type(self, l2_entry, 0, sc_index)
+            else:
+                sc_type = l2_table.subcluster_range_type(l2_index, sc_index)[0]
 
-            if sc_type == QCow2SubclusterType.QCOW2_SUBCLUSTER_COMPRESSED:
-                host_offset = l2_entry & c_qcow2.L2E_COMPRESSED_OFFSET_SIZE_MASK
+            if sc_type == compressed:
+                host_offset = l2_entry & L2E_COMPRESSED_OFFSET_SIZE_MASK
             elif sc_type in NORMAL_SUBCLUSTER_TYPES:
-                host_cluster_offset = l2_entry & c_qcow2.L2E_OFFSET_MASK
+                host_cluster_offset = l2_entry & L2E_OFFSET_MASK
                 host_offset = host_cluster_offset + offset_in_cluster
 
-            nb_clusters = size_to_clusters(self, bytes_needed)
+            nb_clusters = (bytes_needed + cluster_mask) >> cluster_bits
             sc_count = count_contiguous_subclusters(self, nb_clusters, sc_index, l2_table, l2_index)
             # this is the amount of contiguous bytes available of the same subcluster type
-            bytes_available = (sc_count + sc_index) << self.subcluster_bits
+            bytes_available = (sc_count + sc_index) << subcluster_bits
 
             # account for the offset in the cluster
             read_count = min(bytes_available, bytes_needed) - offset_in_cluster
@@ -310,21 +546,111 @@ class QCow2(AlignedStream):
 class L2Table:
     """Convenience class for accessing the L2 table."""
 
+    __slots__ = ("_bitmaps", "_entries", "_range_types", "contiguous", "offset", "qcow2")
+
     def __init__(self, qcow2: QCow2, offset: int):
         self.qcow2 = qcow2
         self.offset = offset
 
         l2_table_size = self.qcow2.l2_size * (self.qcow2._l2_entry_size // 8)
-        self.qcow2.fh.seek(offset)
-        self._table = c_qcow2.uint64[l2_table_size](self.qcow2.fh)
+        table = self.qcow2._read_table(offset, l2_table_size)
+
+        # Extended L2 entries are an entry followed by a subcluster bitmap, split them up front
+        # so every lookup is a single subscript
+        if self.qcow2.has_subclusters:
+            self._entries = table[0::2]
+            self._bitmaps = table[1::2]
+        else:
+            self._entries = table
+            self._bitmaps = None
+
+        # Classifying extended L2 entries takes a fair bit of bit twiddling, so the range types of entries
+        # are filled in as they are looked up, see subcluster_range_type()
+        self._range_types = [None] * len(self._entries) if self._bitmaps is not None else None
+
+        # Converted or fully preallocated images often have L2 tables that map one contiguous range
+        # of fully allocated clusters, which lets us skip counting contiguous subclusters for them entirely
+        first_entry = self.entry(0) if self._entries else 0
+        self.contiguous = (
+            get_cluster_type(self.qcow2, first_entry) == QCOW2_CLUSTER_NORMAL
+            and (self._bitmaps is None or self.bitmap(0) == L2_BITMAP_ALL_ALLOC)
+            and self.is_contiguous(1, self.qcow2.l2_size - 1, first_entry + self.qcow2.cluster_size)
+        )
 
     def entry(self, idx: int) -> int:
-        return self._table[idx * self.qcow2._l2_entry_size // 8]
+        return self._entries[idx]
 
     def bitmap(self, idx: int) -> int:
-        if self.qcow2.has_subclusters:
-            return self._table[(idx * self.qcow2._l2_entry_size // 8) + 1]
-        return 0
+        return 0 if self._bitmaps is None else self._bitmaps[idx]
+
+    def subcluster_range_type(self, idx: int, sc_index: int) -> tuple[QCow2SubclusterType, int]:
+        """Return :func:`get_subcluster_range_type` for subcluster ``sc_index`` of the entry at ``idx``.
+
+        For images with subclusters, the result for the first subcluster of an entry is cached on the table.
+        That's the one that's looked up for every cluster following the start of a run, and as tables are
+        cached themselves, reads of the same region don't have to classify the same entries over and over again.
+        """
+        if sc_index or self._range_types is None:
+            return self.qcow2._get_subcluster_range_type(self.qcow2, self._entries[idx], self.bitmap(idx), sc_index)
+
+        result = self._range_types[idx]
+        if result is None:
+            result = get_subcluster_range_type(self.qcow2, self._entries[idx], self._bitmaps[idx], 0)
+            # There are only a handful of distinct results, share them between entries and tables
+            result = self._range_types[idx] = _RANGE_TYPES.setdefault(result, result)
+        return result
+
+    def is_contiguous(self, idx: int, count: int, l2_entry: int) -> bool:
+        """Return whether the ``count`` entries starting at ``idx`` continue on from ``l2_entry``.
+
+        That is, every entry has the same flags as ``l2_entry``, points to the cluster directly following
+        the previous one and, if the image has subclusters, has all of its subclusters allocated.
+        """
+        cluster_size = self.qcow2.cluster_size
+
+        # Compare whole slices at once instead of walking the entries one by one
+        expected = array.array("Q", range(l2_entry, l2_entry + count * cluster_size, cluster_size))
+        if self._entries[idx : idx + count] != expected:
+            return False
+
+        if self._bitmaps is not None:
+            return self._bitmaps[idx : idx + count] == array.array("Q", [L2_BITMAP_ALL_ALLOC]) * count
+
+        return True
+
+    def contiguous_count(self, idx: int, count: int, l2_entry: int) -> int:
+        """Return how many of the ``count`` entries starting at ``idx`` continue on from ``l2_entry``.
+
+        This is the length of the longest prefix for which :meth:`is_contiguous` holds.
+        """
+        cluster_size = self.qcow2.cluster_size
+
+        entries = self._entries[idx : idx + count]
+        count = len(entries)
+        expected = array.array("Q", range(l2_entry, l2_entry + count * cluster_size, cluster_size))
+
+        bitmaps = all_alloc = None
+        if self._bitmaps is not None:
+            bitmaps = self._bitmaps[idx : idx + count]
+            all_alloc = array.array("Q", [L2_BITMAP_ALL_ALLOC]) * count
+
+        def matches(n: int) -> bool:
+            return entries[:n] == expected[:n] and (bitmaps is None or bitmaps[:n] == all_alloc[:n])
+
+        if matches(count):
+            return count
+
+        # A contiguous prefix stays contiguous when it's shortened, so bisect on whole slice comparisons
+        # to find where the run ends instead of checking every entry
+        lo, hi = 0, count
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if matches(mid):
+                lo = mid
+            else:
+                hi = mid
+
+        return lo
 
 
 class QCow2Snapshot:
@@ -351,61 +677,66 @@ class QCow2Snapshot:
         self.entry_size = self.qcow2.fh.tell() - offset
 
     def open(self) -> QCow2:
-        disk = copy.copy(self.qcow2)
-        disk.l1_table = self.l1_table
-        disk.seek(0)
-        return disk
+        return self.qcow2._clone_with_l1(self.l1_table)
 
     @cached_property
-    def l1_table(self) -> list[int]:
+    def l1_table(self) -> array.array[int]:
         # L1 table is usually relatively small, it can be at most 32MB on PB or EB size disks
-        self.qcow2.fh.seek(self.header.l1_table_offset)
-        return c_qcow2.uint64[self.header.l1_size](self.qcow2.fh)
+        return self.qcow2._read_table(self.header.l1_table_offset, self.header.l1_size)
+
+
+def _unpack_table(buf: bytes) -> array.array[int]:
+    """Unpack a table of big endian 64-bit integers in one go."""
+    table = array.array("Q")
+    table.frombytes(buf)
+    if sys.byteorder == "little":
+        table.byteswap()
+    return table
 
 
 def offset_into_cluster(qcow2: QCow2, offset: int) -> int:
-    return offset & (qcow2.cluster_size - 1)
+    return offset & qcow2._cluster_mask
 
 
 def offset_into_subcluster(qcow2: QCow2, offset: int) -> int:
-    return offset & (qcow2.subcluster_size - 1)
+    return offset & qcow2._subcluster_mask
 
 
 def size_to_clusters(qcow2: QCow2, size: int) -> int:
-    return (size + (qcow2.cluster_size - 1)) >> qcow2.cluster_bits
+    return (size + qcow2._cluster_mask) >> qcow2.cluster_bits
 
 
 def size_to_subclusters(qcow2: QCow2, size: int) -> int:
-    return (size + (qcow2.subcluster_size - 1)) >> qcow2.subcluster_bits
+    return (size + qcow2._subcluster_mask) >> qcow2.subcluster_bits
 
 
 def offset_to_l1_index(qcow2: QCow2, offset: int) -> int:
-    return offset >> (qcow2.l2_bits + qcow2.cluster_bits)
+    return offset >> qcow2._l1_shift
 
 
 def offset_to_l2_index(qcow2: QCow2, offset: int) -> int:
-    return (offset >> qcow2.cluster_bits) & (qcow2.l2_size - 1)
+    return (offset >> qcow2.cluster_bits) & qcow2._l2_mask
 
 
 def offset_to_sc_index(qcow2: QCow2, offset: int) -> int:
-    return (offset >> qcow2.subcluster_bits) & (qcow2.subclusters_per_cluster - 1)
+    return (offset >> qcow2.subcluster_bits) & qcow2._sc_per_cluster_mask
 
 
 def get_cluster_type(qcow2: QCow2, l2_entry: int) -> QCow2ClusterType:
-    if l2_entry & c_qcow2.QCOW_OFLAG_COMPRESSED:
-        return QCow2ClusterType.QCOW2_CLUSTER_COMPRESSED
+    if l2_entry & QCOW_OFLAG_COMPRESSED:
+        return QCOW2_CLUSTER_COMPRESSED
 
-    if (l2_entry & c_qcow2.QCOW_OFLAG_ZERO) and not qcow2.has_subclusters:
-        if l2_entry & c_qcow2.L2E_OFFSET_MASK:
-            return QCow2ClusterType.QCOW2_CLUSTER_ZERO_ALLOC
-        return QCow2ClusterType.QCOW2_CLUSTER_ZERO_PLAIN
+    if (l2_entry & QCOW_OFLAG_ZERO) and not qcow2.has_subclusters:
+        if l2_entry & L2E_OFFSET_MASK:
+            return QCOW2_CLUSTER_ZERO_ALLOC
+        return QCOW2_CLUSTER_ZERO_PLAIN
 
-    if not l2_entry & c_qcow2.L2E_OFFSET_MASK:
-        if qcow2.has_data_file and l2_entry & c_qcow2.QCOW_OFLAG_COPIED:
-            return QCow2ClusterType.QCOW2_CLUSTER_NORMAL
-        return QCow2ClusterType.QCOW2_CLUSTER_UNALLOCATED
+    if not l2_entry & L2E_OFFSET_MASK:
+        if qcow2.has_data_file and l2_entry & QCOW_OFLAG_COPIED:
+            return QCOW2_CLUSTER_NORMAL
+        return QCOW2_CLUSTER_UNALLOCATED
 
-    return QCow2ClusterType.QCOW2_CLUSTER_NORMAL
+    return QCOW2_CLUSTER_NORMAL
 
 
 def get_subcluster_type(qcow2: QCow2, l2_entry: int, l2_bitmap: int, sc_index: int) -> QCow2SubclusterType:
@@ -415,55 +746,67 @@ def get_subcluster_type(qcow2: QCow2, l2_entry: int, l2_bitmap: int, sc_index: i
     sc_zero_mask = sc_alloc_mask << 32
 
     if qcow2.has_subclusters:
-        if c_type == QCow2ClusterType.QCOW2_CLUSTER_COMPRESSED:
-            return QCow2SubclusterType.QCOW2_SUBCLUSTER_COMPRESSED
-        if c_type == QCow2ClusterType.QCOW2_CLUSTER_NORMAL:
+        if c_type == QCOW2_CLUSTER_COMPRESSED:
+            return QCOW2_SUBCLUSTER_COMPRESSED
+        if c_type == QCOW2_CLUSTER_NORMAL:
             if (l2_bitmap >> 32) & l2_bitmap:
-                return QCow2SubclusterType.QCOW2_SUBCLUSTER_INVALID
+                return QCOW2_SUBCLUSTER_INVALID
             if l2_bitmap & sc_zero_mask:  # QCOW_OFLAG_SUB_ZERO(sc_index)
-                return QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_ALLOC
+                return QCOW2_SUBCLUSTER_ZERO_ALLOC
             if l2_bitmap & sc_alloc_mask:  # QCOW_OFLAG_SUB_ALLOC(sc_index)
-                return QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL
-            return QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_ALLOC
-        if c_type == QCow2ClusterType.QCOW2_CLUSTER_UNALLOCATED:
+                return QCOW2_SUBCLUSTER_NORMAL
+            return QCOW2_SUBCLUSTER_UNALLOCATED_ALLOC
+        if c_type == QCOW2_CLUSTER_UNALLOCATED:
             if l2_bitmap & ((1 << 32) - 1):
-                return QCow2SubclusterType.QCOW2_SUBCLUSTER_INVALID
+                return QCOW2_SUBCLUSTER_INVALID
             if l2_bitmap & sc_zero_mask:  # QCOW_OFLAG_SUB_ZERO(sc_index)
-                return QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_PLAIN
-            return QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN
+                return QCOW2_SUBCLUSTER_ZERO_PLAIN
+            return QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN
 
         raise Error(f"Invalid cluster type: {c_type}")
 
-    if c_type == QCow2ClusterType.QCOW2_CLUSTER_COMPRESSED:
-        return QCow2SubclusterType.QCOW2_SUBCLUSTER_COMPRESSED
-    if c_type == QCow2ClusterType.QCOW2_CLUSTER_ZERO_PLAIN:
-        return QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_PLAIN
-    if c_type == QCow2ClusterType.QCOW2_CLUSTER_ZERO_ALLOC:
-        return QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_ALLOC
-    if c_type == QCow2ClusterType.QCOW2_CLUSTER_NORMAL:
-        return QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL
-    if c_type == QCow2ClusterType.QCOW2_CLUSTER_UNALLOCATED:
-        return QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN
+    return CLUSTER_TO_SUBCLUSTER_TYPE[c_type]
 
-    raise Error(f"Invalid cluster type: {c_type}")
+
+def _get_subcluster_type_no_subclusters(
+    qcow2: QCow2, l2_entry: int, l2_bitmap: int, sc_index: int
+) -> QCow2SubclusterType:
+    """Specialized :func:`get_subcluster_type` for images without subclusters.
+
+    Every cluster is a single subcluster here, so this inlines :func:`get_cluster_type` and maps the result directly.
+    """
+    if l2_entry & QCOW_OFLAG_COMPRESSED:
+        return QCOW2_SUBCLUSTER_COMPRESSED
+
+    if l2_entry & QCOW_OFLAG_ZERO:
+        if l2_entry & L2E_OFFSET_MASK:
+            return QCOW2_SUBCLUSTER_ZERO_ALLOC
+        return QCOW2_SUBCLUSTER_ZERO_PLAIN
+
+    if not l2_entry & L2E_OFFSET_MASK:
+        if qcow2.has_data_file and l2_entry & QCOW_OFLAG_COPIED:
+            return QCOW2_SUBCLUSTER_NORMAL
+        return QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN
+
+    return QCOW2_SUBCLUSTER_NORMAL
 
 
 def get_subcluster_range_type(
     qcow2: QCow2, l2_entry: int, l2_bitmap: int, sc_from: int
 ) -> tuple[QCow2SubclusterType, int]:
-    sc_type = get_subcluster_type(qcow2, l2_entry, l2_bitmap, sc_from)
+    sc_type = qcow2._get_subcluster_type(qcow2, l2_entry, l2_bitmap, sc_from)
 
     # No subclusters, so count the entire cluster
-    if not qcow2.has_subclusters or sc_type == QCow2SubclusterType.QCOW2_SUBCLUSTER_COMPRESSED:
+    if not qcow2.has_subclusters or sc_type == QCOW2_SUBCLUSTER_COMPRESSED:
         return sc_type, qcow2.subclusters_per_cluster - sc_from
 
     sc_mask = (1 << sc_from) - 1
-    if sc_type == QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL:
+    if sc_type == QCOW2_SUBCLUSTER_NORMAL:
         val = l2_bitmap | sc_mask  # QCOW_OFLAG_SUB_ALLOC_RANGE(0, sc_from)
-        return sc_type, ctz(val, 32) - sc_from
+        return sc_type, cto(val, 32) - sc_from
     if sc_type in ZERO_SUBCLUSTER_TYPES:
-        val = (l2_bitmap | sc_mask) >> 32  # QCOW_OFLAG_SUB_ZERO_RANGE(0, sc_from)
-        return sc_type, ctz(val, 32) - sc_from
+        val = (l2_bitmap | (sc_mask << 32)) >> 32  # QCOW_OFLAG_SUB_ZERO_RANGE(0, sc_from)
+        return sc_type, cto(val, 32) - sc_from
     if sc_type in UNALLOCATED_SUBCLUSTER_TYPES:
         # We need to mask it with a 64bit mask because Python flips the sign bit
         inv_mask = ~sc_mask & ((1 << 64) - 1)  # ~QCOW_OFLAG_SUB_ALLOC_RANGE(0, sc_from)
@@ -474,43 +817,63 @@ def get_subcluster_range_type(
     raise Error(f"Invalid subcluster type: {sc_type}")
 
 
+def _get_subcluster_range_type_no_subclusters(
+    qcow2: QCow2, l2_entry: int, l2_bitmap: int, sc_from: int
+) -> tuple[QCow2SubclusterType, int]:
+    """Specialized :func:`get_subcluster_range_type` for images without subclusters.
+
+    A cluster is a single subcluster here, so the range always covers the remainder of the cluster.
+    """
+    return _get_subcluster_type_no_subclusters(qcow2, l2_entry, l2_bitmap, sc_from), 1 - sc_from
+
+
 def count_contiguous_subclusters(
     qcow2: QCow2, nb_clusters: int, sc_index: int, l2_table: L2Table, l2_index: int
 ) -> int:
-    count = 0
-    expected_type = None
-    expected_offset = None
-
-    check_offset = False
-    check_offset_types = (
-        QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL,
-        QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_ALLOC,
-        QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_ALLOC,
-    )
-
-    for i in range(nb_clusters):
-        first_sc = sc_index if i == 0 else 0
-        l2_entry = l2_table.entry(l2_index + i)
-        l2_bitmap = l2_table.entry(l2_index + i)
-
-        sc_type, sc_count = get_subcluster_range_type(qcow2, l2_entry, l2_bitmap, first_sc)
-
-        if i == 0:
-            if sc_type == QCow2SubclusterType.QCOW2_SUBCLUSTER_COMPRESSED:
-                return sc_count
-
-            expected_type = sc_type
-            expected_offset = l2_entry & c_qcow2.L2E_OFFSET_MASK
-            check_offset = sc_type in check_offset_types
-        elif sc_type != expected_type:
+    subclusters_per_cluster = qcow2.subclusters_per_cluster
+    if l2_table.contiguous:
+        # Every cluster in this table is fully allocated and directly follows the previous one
+        return nb_clusters * subclusters_per_cluster - sc_index
+
+    cluster_size = qcow2.cluster_size
+    entries = l2_table._entries
+    subcluster_range_type = l2_table.subcluster_range_type
+
+    # The first cluster determines the subcluster type (and host offset) the following clusters must match
+    l2_entry = entries[l2_index]
+    expected_type, count = subcluster_range_type(l2_index, sc_index)
+
+    if expected_type == QCOW2_SUBCLUSTER_COMPRESSED or nb_clusters == 1 or sc_index + count < subclusters_per_cluster:
+        return count
+
+    start = l2_index + 1
+    if expected_type == QCOW2_SUBCLUSTER_NORMAL:
+        # Common case of fully allocated clusters that follow each other in the data file,
+        # count those in one go and only walk the remaining entries one by one
+        contiguous = l2_table.contiguous_count(start, nb_clusters - 1, l2_entry + cluster_size)
+        count += contiguous * subclusters_per_cluster
+        if contiguous == nb_clusters - 1:
+            return count
+
+        start += contiguous
+        l2_entry += contiguous * cluster_size
+
+    # Subcluster types that have a host offset, which must be contiguous as well
+    check_offset = expected_type in NORMAL_SUBCLUSTER_TYPES
+    expected_offset = l2_entry & L2E_OFFSET_MASK
+
+    for idx in range(start, l2_index + nb_clusters):
+        sc_type, sc_count = subcluster_range_type(idx, 0)
+        if sc_type != expected_type:
             break
-        elif check_offset:
-            expected_offset += qcow2.cluster_size
-            if expected_offset != l2_entry & c_qcow2.L2E_OFFSET_MASK:
+
+        if check_offset:
+            expected_offset += cluster_size
+            if expected_offset != entries[idx] & L2E_OFFSET_MASK:
                 break
 
         count += sc_count
-        if first_sc + sc_count < qcow2.subclusters_per_cluster:
+        if sc_count < subclusters_per_cluster:
             break
 
     return count
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 import array
-from typing import BinaryIO
+import sys
+from typing import TYPE_CHECKING, BinaryIO
 
 from dissect.util.stream import AlignedStream
 
 from dissect.hypervisor.disk.c_vdi import SPARSE, UNALLOCATED, VDI_SIGNATURE, c_vdi
 from dissect.hypervisor.exceptions import Error
+from dissect.hypervisor.util.fileio import preadv_fileno, readinto_exact_at
+from dissect.hypervisor.util.readahead import SequentialReadahead
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
 
 
 class VDI(AlignedStream):
@@ -23,40 +29,72 @@ class VDI(AlignedStream):
 
         self.fh.seek(self.header.BlocksOffset)
 
-        mapbuf = self.fh.read(4 * self.header.BlocksInHDD)
+        # The block map is an array of little endian 32-bit integers, decode it in one go
         self.map = array.array("i")
-        try:
-            self.map.frombytes(mapbuf)
-        except AttributeError:
-            self.map.fromstring(mapbuf)
+        self.map.frombytes(self.fh.read(4 * self.header.BlocksInHDD))
+        if sys.byteorder == "big":
+            self.map.byteswap()
 
         self.data_offset = self.header.DataOffset
         self.block_size = self.header.BlockSize
         self.sector_size = self.header.SectorSize
+        self._readahead = SequentialReadahead(fh)
+        # Read data with a single positional read call if the image is an OS level file
+        self._fd = preadv_fileno(fh)
         super().__init__(size=self.header.DiskSize)
 
     def _read(self, offset: int, length: int) -> bytes:
-        block_idx, block_offset = divmod(offset, self.block_size)
+        # Aligned reads can extend past the end of the disk, there's nothing to translate there
+        length = min(length, self.size - offset)
+        if length <= 0:
+            return b""
 
-        bytes_read = []
-        while length > 0:
-            read_len = min(length, max(length, self.block_size))
+        self._readahead.update(offset, length)
 
-            block = self.map[block_idx]
+        result = bytearray(length)
+        view = memoryview(result)
+        pos = 0
 
+        # Sparse runs need no work, the buffer is already zero filled
+        for block, run_offset, run_length in self._iter_runs(offset, length):
             if block == UNALLOCATED:
                 if self.parent:
-                    bytes_read.append(self.parent._read(offset, read_len))
-                else:
-                    bytes_read.append(b"\x00" * read_len)
-            elif block == SPARSE:
-                bytes_read.append(b"\x00" * read_len)
-            else:
-                self.fh.seek(self.data_offset + (block * self.block_size) + block_offset)
-                bytes_read.append(self.fh.read(read_len))
+                    buf = self.parent._read(run_offset, run_length)
+                    view[pos : pos + len(buf)] = buf
+            elif block != SPARSE:
+                file_offset = self.data_offset + (block * self.block_size) + (run_offset % self.block_size)
+                readinto_exact_at(self.fh, self._fd, view[pos : pos + run_length], file_offset)
+
+            pos += run_length
+
+        return bytes(result)
+
+    def _iter_runs(self, offset: int, length: int) -> Iterator[tuple[int, int, int]]:
+        """Yield ``(block, offset, length)`` runs of consecutive blocks that can be read in one go.
 
-            offset += read_len
-            length -= read_len
+        Consecutive sparse or unallocated blocks are merged into a single run, as are allocated blocks
+        that are stored back to back in the image file. For allocated runs, ``block`` is the first block.
+        """
+        block_size = self.block_size
+        end = offset + length
+        block_idx = offset // block_size
+
+        run_block = prev_block = self.map[block_idx]
+        run_offset = offset
+        run_length = min(length, block_size - (offset % block_size))
+
+        for block in self.map[block_idx + 1 : (end - 1) // block_size + 1]:
             block_idx += 1
+            read_len = min(end - block_idx * block_size, block_size)
+
+            if (block < 0 and block == prev_block) or (block >= 0 and prev_block >= 0 and block == prev_block + 1):
+                run_length += read_len
+            else:
+                yield run_block, run_offset, run_length
+                run_block = block
+                run_offset = block_idx * block_size
+                run_length = read_len
+
+            prev_block = block
 
-        return b"".join(bytes_read)
+        yield run_block, run_offset, run_length
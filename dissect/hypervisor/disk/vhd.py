@@ -1,13 +1,19 @@
 from __future__ import annotations
 
+import array
 import io
-import struct
-from functools import lru_cache
-from typing import BinaryIO
+import sys
+from functools import cached_property
+from typing import TYPE_CHECKING, BinaryIO
 
 from dissect.util.stream import AlignedStream
 
 from dissect.hypervisor.disk.c_vhd import SECTOR_SIZE, c_vhd
+from dissect.hypervisor.util.fileio import preadv_fileno, readinto_exact_at
+from dissect.hypervisor.util.readahead import SequentialReadahead
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
 
 
 def read_footer(fh: BinaryIO) -> c_vhd.footer:
@@ -32,9 +38,12 @@ class VHD(AlignedStream):
         else:
             self.disk = DynamicDisk(fh, footer)
 
+        self._readahead = SequentialReadahead(fh)
         super().__init__(self.disk.size)
 
     def _read(self, offset: int, length: int) -> bytes:
+        self._readahead.update(offset, length)
+
         sector = offset // SECTOR_SIZE
         count = (length + SECTOR_SIZE - 1) // SECTOR_SIZE
 
@@ -68,27 +77,57 @@ class DynamicDisk(Disk):
         # Sector bitmaps are padded to SECTOR_SIZE boundaries
         # Save bitmap size in sectors
         self._sector_bitmap_size = ((self._sectors_per_block // 8) + SECTOR_SIZE - 1) // SECTOR_SIZE
+        # Read data with a single positional read call if the image is an OS level file
+        self._fd = preadv_fileno(fh)
 
     def read_sectors(self, sector: int, count: int) -> bytes:
-        result = []
+        result = bytearray(count * SECTOR_SIZE)
+        view = memoryview(result)
+        pos = 0
+
+        # Sparse runs need no work, the buffer is already zero filled
+        for sector_offset, run_sector, run_count in self._iter_runs(sector, count):
+            run_size = run_count * SECTOR_SIZE
+            if sector_offset is not None:
+                offset = run_sector % self._sectors_per_block
+                file_offset = (sector_offset + self._sector_bitmap_size + offset) * SECTOR_SIZE
+                readinto_exact_at(self.fh, self._fd, view[pos : pos + run_size], file_offset)
+
+            pos += run_size
+
+        return bytes(result)
+
+    def _iter_runs(self, sector: int, count: int) -> Iterator[tuple[int | None, int, int]]:
+        """Yield ``(sector_offset, sector, count)`` runs of sectors that can be read in one go.
+
+        Consecutive sparse blocks, including blocks with a BAT entry of 0, are merged into a single run with a
+        ``sector_offset`` of ``None``.
+        Allocated blocks are always yielded separately, even if they're stored back to back in the file,
+        because the sector bitmap of a block sits between its data and that of the previous block.
+        """
+        run_offset = None
+        run_sector = sector
+        run_count = 0
+
         while count > 0:
             block, offset = divmod(sector, self._sectors_per_block)
-            block_remaining = self._sectors_per_block - offset
+            read_count = min(count, self._sectors_per_block - offset)
 
-            read_count = min(count, block_remaining)
+            # A sector offset of 0 is treated as sparse as well, that's where the footer copy lives
+            sector_offset = self.bat[block] or None
+            if run_count and (sector_offset is not None or run_offset is not None):
+                yield run_offset, run_sector, run_count
+                run_sector = sector
+                run_count = 0
 
-            sector_offset = self.bat[block]
-            if sector_offset:
-                self.fh.seek((sector_offset + self._sector_bitmap_size + offset) * SECTOR_SIZE)
-                result.append(self.fh.read(read_count * SECTOR_SIZE))
-            else:
-                # Sparse
-                result.append((b"\x00" * SECTOR_SIZE) * read_count)
+            run_offset = sector_offset
+            run_count += read_count
 
             sector += read_count
             count -= read_count
 
-        return b"".join(result)
+        if run_count:
+            yield run_offset, run_sector, run_count
 
 
 class BlockAllocationTable:
@@ -97,22 +136,25 @@ class BlockAllocationTable:
     Entries are uint32 sector offsets to blocks in the file.
     """
 
-    ENTRY = struct.Struct(">I")
-
     def __init__(self, fh: BinaryIO, offset: int, max_entries: int):
         self.fh = fh
         self.offset = offset
         self.max_entries = max_entries
 
-        self.get = lru_cache(4096)(self.get)
+    @cached_property
+    def table(self) -> array.array[int]:
+        # Even for the largest disks the BAT is only a few MiB, so read and decode it in one go
+        table = array.array("I", [0]) * self.max_entries
+        readinto_exact_at(self.fh, None, memoryview(table).cast("B"), self.offset)
+        if sys.byteorder == "little":
+            table.byteswap()
+        return table
 
     def get(self, block: int) -> int | None:
-        # This could be improved by caching the entire BAT (or chunks if too large)
         if block + 1 > self.max_entries:
             raise ValueError(f"Invalid block {block} (max block is {self.max_entries - 1})")
 
-        self.fh.seek(self.offset + block * 4)
-        sector_offset = self.ENTRY.unpack(self.fh.read(4))[0]
+        sector_offset = self.table[block]
         if sector_offset == 0xFFFFFFFF:
             sector_offset = None
         return sector_offset
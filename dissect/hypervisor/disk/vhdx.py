@@ -3,17 +3,21 @@
 
 from __future__ import annotations
 
+import array
 import logging
 import os
+import sys
 from functools import lru_cache
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Final
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Final, NamedTuple
 from uuid import UUID
 
 from dissect.util.stream import AlignedStream
 
 from dissect.hypervisor.disk.c_vhdx import (
     ALIGNMENT,
+    BAT_ENTRY_FILE_OFFSET_MB_SHIFT,
+    BAT_ENTRY_STATE_MASK,
     BAT_REGION_GUID,
     FILE_PARAMETERS_GUID,
     LOGICAL_SECTOR_SIZE_GUID,
@@ -27,6 +31,8 @@ from dissect.hypervisor.disk.c_vhdx import (
     c_vhdx,
 )
 from dissect.hypervisor.exceptions import InvalidSignature, InvalidVirtualDisk
+from dissect.hypervisor.util.fileio import preadv_fileno, readinto_exact_at
+from dissect.hypervisor.util.readahead import SequentialReadahead
 
 if TYPE_CHECKING:
     from collections.abc import Iterator
@@ -56,6 +62,8 @@ class VHDX(AlignedStream):
 
         self.fh = fh
         self.path = path
+        # Read data with a single positional read call if the image is an OS level file
+        self._fd = preadv_fileno(fh)
 
         self.file_identifier = c_vhdx.file_identifier(fh)
         if self.file_identifier.signature != b"vhdxfile":
@@ -101,25 +109,27 @@ class VHDX(AlignedStream):
         bat_entry = self.region_table.get(BAT_REGION_GUID)
         self.bat = BlockAllocationTable(self, bat_entry.file_offset)
 
+        self._readahead = SequentialReadahead(fh)
         super().__init__(self.size)
 
     def read_sectors(self, sector: int, count: int) -> bytes:
         log.debug("VHDX::read_sectors(0x%x, 0x%x)", sector, count)
-        sectors_read = []
+        # Empty sectors need no work, the buffer is already zero filled
+        result = bytearray(count * self.sector_size)
+        view = memoryview(result)
+        pos = 0
 
         while count > 0:
-            read_count = min(count, self._sectors_per_block)
-            read_size = read_count * self.sector_size
             block, sector_in_block = divmod(sector, self._sectors_per_block)
+            read_count = min(count, self._sectors_per_block - sector_in_block)
+            read_size = read_count * self.sector_size
             bat_entry = self.bat.pb(block)
 
             if bat_entry.state == c_vhdx.PAYLOAD_BLOCK_NOT_PRESENT:
                 # The block is not present in this file
                 # If we have a parent, read it from there, otherwise keep it empty
                 if self.parent:
-                    sectors_read.append(self.parent.read_sectors(sector, read_count))
-                else:
-                    sectors_read.append(b"\x00" * read_size)
+                    view[pos : pos + read_size] = self.parent.read_sectors(sector, read_count)
             elif bat_entry.state in (
                 c_vhdx.PAYLOAD_BLOCK_UNDEFINED,
                 c_vhdx.PAYLOAD_BLOCK_ZERO,
@@ -127,12 +137,12 @@ class VHDX(AlignedStream):
             ):
                 # The block is not allocated at all
                 # Keep it empty
-                sectors_read.append(b"\x00" * read_size)
+                pass
             elif bat_entry.state == c_vhdx.PAYLOAD_BLOCK_FULLY_PRESENT:
                 # The block is fully present in this file
                 # Read everything from this file.
-                self.fh.seek((bat_entry.file_offset_mb * MB) + (sector_in_block * self.sector_size))
-                sectors_read.append(self.fh.read(read_size))
+                file_offset = (bat_entry.file_offset_mb * MB) + (sector_in_block * self.sector_size)
+                readinto_exact_at(self.fh, self._fd, view[pos : pos + read_size], file_offset)
             elif bat_entry.state == c_vhdx.PAYLOAD_BLOCK_PARTIALLY_PRESENT:
                 # The block is only partially present in this file
                 # Read the sector bitmap to know what to read from this file and what to read from the parent
@@ -148,30 +158,37 @@ class VHDX(AlignedStream):
                 # Seek into the bitmap to where we are relative in the cluster
                 self.fh.seek((sector_bitmap_entry.file_offset_mb * MB) + byte_idx)
                 # Read the bitmap for the amount of sectors we're interested in, rounded up
-                sector_bitmap = self.fh.read((read_count + 8 - 1) // 8)
+                sector_bitmap = self.fh.read((bit_idx + read_count + 8 - 1) // 8)
 
                 # Calculate runs from the bitmap and read from the correct source
                 relative_sector = 0
                 for run_type, run_count in _iter_partial_runs(sector_bitmap, bit_idx, read_count):
+                    run_pos = pos + relative_sector * self.sector_size
+                    run_size = run_count * self.sector_size
+
                     if run_type == 0:
                         # Read from parent
-                        sectors_read.append(self.parent.read_sectors(sector + relative_sector, run_count))
+                        buf = self.parent.read_sectors(sector + relative_sector, run_count)
+                        view[run_pos : run_pos + run_size] = buf
                     else:
                         # Read from this file
                         # Here we are calculating relative to the block again
-                        self.fh.seek(
-                            (bat_entry.file_offset_mb * MB) + ((sector_in_block + relative_sector) * self.sector_size)
+                        file_offset = (bat_entry.file_offset_mb * MB) + (
+                            (sector_in_block + relative_sector) * self.sector_size
                         )
-                        sectors_read.append(self.fh.read(run_count * self.sector_size))
+                        readinto_exact_at(self.fh, self._fd, view[run_pos : run_pos + run_size], file_offset)
 
                     relative_sector += run_count
 
             sector += read_count
             count -= read_count
+            pos += read_size
 
-        return b"".join(sectors_read)
+        return bytes(result)
 
     def _read(self, offset: int, length: int) -> bytes:
+        self._readahead.update(offset, length)
+
         sector = offset // self.sector_size
         count = (length + self.sector_size - 1) // self.sector_size
 
@@ -198,7 +215,19 @@ class RegionTable:
         return data
 
 
+class BatEntry(NamedTuple):
+    """A decoded BAT entry, equivalent to ``c_vhdx.bat_entry``."""
+
+    state: int
+    file_offset_mb: int
+
+
 class BlockAllocationTable:
+    # The BAT is read in chunks of this many entries, so large tables don't have to be read in full at once
+    CHUNK_ENTRIES = 64 * 1024
+    # Keep up to 64 MiB worth of BAT chunks in memory, which covers the entire BAT of all but the largest disks
+    CHUNK_CACHE_SIZE = 128
+
     def __init__(self, vhdx: VHDX, offset: int):
         self.vhdx = vhdx
         self.offset = offset
@@ -212,23 +241,36 @@ class BlockAllocationTable:
         else:
             self.entry_count = self._pb_count + ((self._pb_count - 1) // self.chunk_ratio)
 
-        self.get = lru_cache(4096)(self.get)
+        self._read_chunk = lru_cache(self.CHUNK_CACHE_SIZE)(self._read_chunk)
 
-    def get(self, entry: int) -> c_vhdx.bat_entry:
+    def _read_chunk(self, chunk: int) -> array.array[int]:
+        """Read and decode a chunk of ``CHUNK_ENTRIES`` raw BAT entries in one go."""
+        start = chunk * self.CHUNK_ENTRIES
+        count = min(self.CHUNK_ENTRIES, self.entry_count - start)
+
+        table = array.array("Q", [0]) * count
+        readinto_exact_at(self.vhdx.fh, None, memoryview(table).cast("B"), self.offset + start * 8)
+        if sys.byteorder == "big":
+            table.byteswap()
+        return table
+
+    def get(self, entry: int) -> BatEntry:
         """Get a BAT entry."""
         if entry + 1 > self.entry_count:
             raise ValueError(f"Invalid entry for BAT lookup: {entry} (max entry is {self.entry_count - 1})")
 
-        self.vhdx.fh.seek(self.offset + entry * 8)
-        return c_vhdx.bat_entry(self.vhdx.fh)
+        chunk, idx = divmod(entry, self.CHUNK_ENTRIES)
+        value = self._read_chunk(chunk)[idx]
+        # Decode the bitfield directly instead of going through c_vhdx.bat_entry
+        return BatEntry(value & BAT_ENTRY_STATE_MASK, value >> BAT_ENTRY_FILE_OFFSET_MB_SHIFT)
 
-    def pb(self, block: int) -> c_vhdx.bat_entry:
+    def pb(self, block: int) -> BatEntry:
         """Get a payload block entry for a given block."""
         # Calculate how many interleaved sector bitmap entries there must be for this block
         sb_entries = block // self.chunk_ratio
         return self.get(block + sb_entries)
 
-    def sb(self, block: int) -> c_vhdx.bat_entry:
+    def sb(self, block: int) -> BatEntry:
         """Get a sector bitmap entry for a given block."""
         # Calculate how many interleaved sector bitmap entries there must be for this block
         num_sb = block // self.chunk_ratio
@@ -291,27 +333,38 @@ class MetadataTable:
 
 
 def _iter_partial_runs(bitmap: bytes, start_idx: int, length: int) -> Iterator[tuple[int, int]]:
-    current_type = (bitmap[0] & (1 << start_idx)) >> start_idx
-    current_count = 0
+    """Yield ``(type, count)`` runs of equal bits in a sector bitmap, starting at bit ``start_idx`` of the first byte.
 
-    for byte in bitmap:
-        if (current_type, byte) == (0, 0) or (current_type, byte) == (1, 0xFF):
-            max_count = min(length, 8 - start_idx)
-            current_count += max_count
-            length -= max_count
-            start_idx = 0
-        else:
-            for bit_idx in range(start_idx, min(length, 8)):
-                sector_type = (byte & (1 << bit_idx)) >> bit_idx
-
-                if sector_type == current_type:
-                    current_count += 1
-                else:
-                    yield (current_type, current_count)
-                    current_type = sector_type
-                    current_count = 1
+    The bitmap is processed 64 bits at a time. Runs are found by counting trailing zero bits, with the word inverted
+    whenever the current run is one of set bits, so long uniform stretches cost a single step.
+    """
+    current_type = (bitmap[0] >> start_idx) & 1
+    current_count = 0
 
-                length -= 1
+    pos = 0
+    while pos < length:
+        bit_pos = start_idx + pos
+        count = min(64, length - pos)
+        pos += count
+
+        mask = (1 << count) - 1
+        word = (int.from_bytes(bitmap[bit_pos >> 3 : (bit_pos >> 3) + 9], "little") >> (bit_pos & 7)) & mask
+        if current_type:
+            # Make the bits of the current run type zero
+            word ^= mask
+
+        while word:
+            # The number of trailing zeroes is the number of bits left in the current run
+            same = (word & -word).bit_length() - 1
+            current_count += same
+            yield (current_type, current_count)
+
+            current_type ^= 1
+            current_count = 0
+            count -= same
+            word = (word >> same) ^ ((1 << count) - 1)
+
+        current_count += count
 
     if current_count:
         yield (current_type, current_count)
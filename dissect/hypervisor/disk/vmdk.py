@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import array
 import ctypes
 import io
 import logging
 import os
 import re
+import sys
 import textwrap
 import zlib
 from bisect import bisect_right
@@ -17,11 +19,14 @@ from dissect.util.stream import AlignedStream
 
 from dissect.hypervisor.disk.c_vmdk import (
     COWD_MAGIC,
+    GRAIN_LBA_HEADER,
+    GRAIN_SIZE_HEADER,
     SECTOR_SIZE,
     SESPARSE_MAGIC,
     VMDK_MAGIC,
     c_vmdk,
 )
+from dissect.hypervisor.util.fileio import readinto_exact_at
 
 log = logging.getLogger(__name__)
 log.setLevel(os.getenv("DISSECT_LOG_VMDK", "CRITICAL"))
@@ -185,8 +190,7 @@ class SparseDisk:
 
             grain_directory_offset = self.header.primary_grain_directory_offset
             self._grain_entry_type = c_vmdk.uint32
-
-            self._grain_directory = c_vmdk.uint32[self._grain_directory_size](fh)
+            self._grain_entry_typecode = "I"
 
         elif self.header.magic == c_vmdk.SESPARSE_CONST_HEADER_MAGIC:
             self.is_sesparse = True
@@ -196,16 +200,17 @@ class SparseDisk:
 
             grain_directory_offset = self.header.grain_directory_offset
             self._grain_entry_type = c_vmdk.uint64
+            self._grain_entry_typecode = "Q"
 
         self.fh.seek(grain_directory_offset * SECTOR_SIZE)
-        self._grain_directory = self._grain_entry_type[self._grain_directory_size](fh)
+        self._grain_directory = _read_entries(fh, self._grain_entry_typecode, self._grain_directory_size)
 
         self.size = self.header.capacity * SECTOR_SIZE
         self.sector_count = self.header.capacity
 
         self._lookup_grain_table = lru_cache(128)(self._lookup_grain_table)
 
-    def _lookup_grain_table(self, directory: int) -> list[int]:
+    def _lookup_grain_table(self, directory: int) -> array.array[int] | None:
         gtbl_offset = self._grain_directory[directory]
 
         if self.is_sesparse:
@@ -223,11 +228,11 @@ class SparseDisk:
                     self.header.grain_tables_offset + gtbl_offset * (self._grain_table_size * 8) // SECTOR_SIZE
                 )
                 self.fh.seek(gtbl_offset * SECTOR_SIZE)
-                table = self._grain_entry_type[self._grain_table_size](self.fh)
+                table = _read_entries(self.fh, self._grain_entry_typecode, self._grain_table_size)
         else:
             if gtbl_offset:
                 self.fh.seek(gtbl_offset * SECTOR_SIZE)
-                table = self._grain_entry_type[self._grain_table_size](self.fh)
+                table = _read_entries(self.fh, self._grain_entry_typecode, self._grain_table_size)
             else:
                 table = None
 
@@ -321,28 +326,32 @@ class SparseDisk:
         log.debug("SparseDisk::read_sectors(0x%x, 0x%x)", sector, count)
 
         runs = self.get_runs(sector, count)
-        sectors_read = []
+
+        # Sparse grains and grains without a parent need no work, the buffer is already zero filled
+        result = bytearray(count * SECTOR_SIZE)
+        view = memoryview(result)
+        pos = 0
 
         for run_type, run_offset, run_count, run_parent in runs:
+            run_size = run_count * SECTOR_SIZE
+
             # Grain not present
             if run_type == 0:
                 if self.parent:
-                    sector_data = self.parent.read_sectors(run_parent, run_count)
-                else:
-                    sector_data = b"\x00" * (run_count * SECTOR_SIZE)
-                sectors_read.append(sector_data)
+                    buf = self.parent.read_sectors(run_parent, run_count)
+                    view[pos : pos + len(buf)] = buf
+                pos += run_size
                 continue
 
             # Sparse grain
             if run_type == 1:
-                sectors_read.append(b"\x00" * (run_count * SECTOR_SIZE))
+                pos += run_size
                 continue
 
             # Uncompressed grain
             if self.header.flags & c_vmdk.SPARSEFLAG_COMPRESSED == 0:
-                self.fh.seek((run_type + run_offset) * SECTOR_SIZE)
-                sector_data = self.fh.read(run_count * SECTOR_SIZE)
-                sectors_read.append(sector_data)
+                readinto_exact_at(self.fh, None, view[pos : pos + run_size], (run_type + run_offset) * SECTOR_SIZE)
+                pos += run_size
                 continue
 
             # Compressed grain
@@ -352,28 +361,29 @@ class SparseDisk:
                 offset = run_offset * SECTOR_SIZE
                 grain_remaining = self.header.grain_size - run_offset
                 read_count = min(run_count, grain_remaining)
+                read_size = read_count * SECTOR_SIZE
 
-                buf = self._read_compressed_grain(run_type)
-                sectors_read.append(buf[offset : offset + read_count * SECTOR_SIZE])
+                buf = self._read_compressed_grain(run_type)[offset : offset + read_size]
+                view[pos : pos + len(buf)] = buf
+                pos += read_size
 
                 # If we loop, we're going to the next run, which means we'll start at offset 0
                 run_offset = 0
                 run_type += self.header.grain_size
                 run_count -= read_count
 
-        return b"".join(sectors_read)
+        return bytes(result)
 
     def _read_compressed_grain(self, sector: int) -> bytes:
         self.fh.seek(sector * SECTOR_SIZE)
         buf = self.fh.read(SECTOR_SIZE)
 
         if self.header.flags & c_vmdk.SPARSEFLAG_EMBEDDED_LBA:
-            header_len = 12
-            lba_header = c_vmdk.SparseGrainLBAHeaderOnDisk(buf)
-            compressed_len = lba_header.cmp_size
+            header_len = GRAIN_LBA_HEADER.size
+            _, compressed_len = GRAIN_LBA_HEADER.unpack_from(buf)
         else:
-            header_len = 4
-            compressed_len = c_vmdk.uint32(buf)
+            header_len = GRAIN_SIZE_HEADER.size
+            (compressed_len,) = GRAIN_SIZE_HEADER.unpack_from(buf)
 
         if compressed_len + header_len > SECTOR_SIZE:
             # Officially this is padded to SECTOR_SIZE, but we don't really care
@@ -529,6 +539,15 @@ class DiskDescriptor:
         return str_template.format(descriptor_settings, extents, disk_db)
 
 
+def _read_entries(fh: BinaryIO, typecode: str, count: int) -> array.array[int]:
+    """Read a table of ``count`` little endian integers of the given ``array`` typecode in one go."""
+    entries = array.array(typecode)
+    entries.frombytes(fh.read(count * entries.itemsize))
+    if sys.byteorder == "big":
+        entries.byteswap()
+    return entries
+
+
 def open_parent(path: Path, filename_hint: str) -> VMDK:
     try:
         filename_hint = filename_hint.replace("\\", "/")
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import io
+import os
+from typing import BinaryIO
+
+
+def os_fileno(fh: BinaryIO) -> int | None:
+    """Return the file descriptor of ``fh`` if it's a plain OS level file.
+
+    Only regular (optionally buffered) files qualify. File-likes such as ``gzip.GzipFile`` also have a
+    ``fileno()``, but it refers to the underlying compressed file, which holds entirely different data.
+    """
+    raw = fh.raw if isinstance(fh, (io.BufferedReader, io.BufferedRandom)) else fh
+    if not isinstance(raw, io.FileIO):
+        return None
+
+    try:
+        return raw.fileno()
+    except (OSError, ValueError):
+        return None
+
+
+def preadv_fileno(fh: BinaryIO) -> int | None:
+    """Return the file descriptor of ``fh`` if it's an OS level file we can read from with ``os.preadv``."""
+    if not hasattr(os, "preadv"):
+        return None
+
+    return os_fileno(fh)
+
+
+def readinto_at(fh: BinaryIO, fd: int | None, buf: memoryview, offset: int) -> int:
+    """Read from ``offset`` in ``fh`` into ``buf``.
+
+    If ``fd`` is given, this uses positional reads that leave the file position of ``fh`` alone.
+    Otherwise it falls back to a seek and ``readinto`` on ``fh``, or ``read`` if ``fh`` has no ``readinto``.
+    Short reads are repeated until ``buf`` is full or the end of the file is reached, since a single read can
+    return less than requested. For example, Linux caps a single read at ``0x7ffff000`` bytes.
+
+    Args:
+        fh: The file to read from.
+        fd: The file descriptor of ``fh`` as returned by :func:`preadv_fileno`, or ``None``.
+        buf: The buffer to read into.
+        offset: The offset in ``fh`` to read from.
+
+    Returns:
+        The number of bytes read.
+    """
+    if fd is None:
+        fh.seek(offset)
+
+    total = 0
+    while total < len(buf):
+        remaining = buf[total:]
+        if fd is not None:
+            count = os.preadv(fd, [remaining], offset + total)
+        elif hasattr(fh, "readinto"):
+            count = fh.readinto(remaining)
+        else:
+            data = fh.read(len(remaining))
+            count = len(data)
+            remaining[:count] = data
+
+        if not count:
+            break
+        total += count
+
+    return total
+
+
+def readinto_exact_at(fh: BinaryIO, fd: int | None, buf: memoryview, offset: int) -> None:
+    """Fill ``buf`` from ``offset`` in ``fh``, like :func:`readinto_at`.
+
+    Use this where a short read means the image file is truncated, rather than something to zero fill.
+
+    Raises:
+        EOFError: If the end of the file is reached before ``buf`` is full.
+    """
+    count = readinto_at(fh, fd, buf, offset)
+    if count != len(buf):
+        raise EOFError(f"Read {count} bytes, but expected {len(buf)}")
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import os
+from typing import BinaryIO
+
+from dissect.hypervisor.util.fileio import os_fileno
+
+# Number of directly consecutive reads after which access is considered sequential
+SEQUENTIAL_READ_THRESHOLD = 2
+
+
+def fileno(fh: BinaryIO) -> int | None:
+    """Return the file descriptor of ``fh`` if it's an OS level file we can give read-ahead hints for."""
+    if not hasattr(os, "posix_fadvise"):
+        return None
+
+    return os_fileno(fh)
+
+
+class SequentialReadahead:
+    """Tell the OS to read ahead more aggressively on a file while the reads from a disk are sequential.
+
+    Disk implementations call :meth:`update` with every offset and length they read. Once enough reads
+    directly follow each other, the file is advised as ``POSIX_FADV_SEQUENTIAL``, and back to
+    ``POSIX_FADV_NORMAL`` as soon as the access pattern turns random again.
+
+    Offsets are those of the virtual disk, not the underlying file. Sequential reads of a disk mostly
+    translate to sequential reads of its file, and it spares callers from translating offsets first.
+
+    Args:
+        fh: The file to give the hints for. Hints are silently skipped if it's not an OS level file.
+    """
+
+    def __init__(self, fh: BinaryIO):
+        self.fd = fileno(fh)
+        self.sequential = False
+        self._next_offset = None
+        self._count = 0
+
+    def update(self, offset: int, length: int) -> None:
+        if self.fd is None:
+            return
+
+        self._count = self._count + 1 if offset == self._next_offset else 0
+        self._next_offset = offset + length
+
+        sequential = self._count >= SEQUENTIAL_READ_THRESHOLD
+        if sequential == self.sequential:
+            return
+
+        try:
+            os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL if sequential else os.POSIX_FADV_NORMAL)
+        except OSError:
+            # Not supported for this file, don't bother trying again
+            self.fd = None
+            return
+
+        self.sequential = sequential
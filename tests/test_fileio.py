@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import gzip
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+import pytest
+
+from dissect.hypervisor.util.fileio import os_fileno, preadv_fileno, readinto_at, readinto_exact_at
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def test_os_fileno(tmp_path: Path) -> None:
+    path = tmp_path / "disk.img"
+    path.write_bytes(b"\x00" * 512)
+
+    with path.open("rb") as fh:
+        assert os_fileno(fh) == fh.fileno()
+
+    gz_path = tmp_path / "disk.img.gz"
+    with gzip.open(gz_path, "wb") as fh:
+        fh.write(b"\x00" * 512)
+
+    # The file descriptor of a GzipFile is that of the compressed file, which we can't read guest data from
+    with gzip.open(gz_path, "rb") as fh:
+        assert os_fileno(fh) is None
+
+    assert os_fileno(BytesIO(b"\x00" * 512)) is None
+
+
+def test_readinto_at(tmp_path: Path) -> None:
+    data = bytes(range(256)) * 4
+
+    path = tmp_path / "disk.img"
+    path.write_bytes(data)
+
+    with path.open("rb") as fh:
+        for f, fd in ((fh, preadv_fileno(fh)), (BytesIO(data), None)):
+            buf = bytearray(16)
+            assert readinto_at(f, fd, memoryview(buf), 300) == 16
+            assert buf == data[300:316]
+
+
+def test_readinto_at_read_only() -> None:
+    class ReadOnly:
+        def __init__(self, data: bytes):
+            self.fh = BytesIO(data)
+            self.seek = self.fh.seek
+            self.read = self.fh.read
+
+    data = bytes(range(256))
+
+    buf = bytearray(16)
+    assert readinto_at(ReadOnly(data), None, memoryview(buf), 100) == 16
+    assert buf == data[100:116]
+
+    # Short reads leave the rest of the buffer untouched
+    buf = bytearray(16)
+    assert readinto_at(ReadOnly(data), None, memoryview(buf), 250) == 6
+    assert buf == data[250:] + b"\x00" * 10
+
+
+def test_readinto_at_short_reads() -> None:
+    class Trickle(BytesIO):
+        def readinto(self, buf: memoryview) -> int:
+            return super().readinto(buf[:3])
+
+    data = bytes(range(256))
+
+    buf = bytearray(16)
+    assert readinto_at(Trickle(data), None, memoryview(buf), 100) == 16
+    assert buf == data[100:116]
+
+    buf = bytearray(16)
+    readinto_exact_at(Trickle(data), None, memoryview(buf), 100)
+    assert buf == data[100:116]
+
+    with pytest.raises(EOFError, match="Read 6 bytes, but expected 16"):
+        readinto_exact_at(Trickle(data), None, memoryview(bytearray(16)), 250)
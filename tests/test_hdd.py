@@ -1,11 +1,17 @@
 from __future__ import annotations
 
 import gzip
+from io import BytesIO
 from pathlib import Path
 from typing import BinaryIO
 from unittest.mock import patch
+from uuid import UUID
 
-from dissect.hypervisor.disk.hdd import HDD
+import pytest
+from defusedxml import ElementTree
+
+from dissect.hypervisor.disk.c_hdd import c_hdd
+from dissect.hypervisor.disk.hdd import HDD, HDS, Snapshots
 
 Path_open = Path.open
 
@@ -91,3 +97,70 @@ def test_file_use_parent(plain_hdd: str) -> None:
     storages = hdd.descriptor.storage_data.storages
 
     assert len(storages) == 1
+
+
+def _build_hds(bat: list[int], data: bytes) -> BytesIO:
+    # 1 sector clusters, the header and BAT in the first sector and the data from the second sector onwards
+    header = c_hdd.pvd_header(
+        m_Sig=c_hdd.SIGNATURE_STRUCTURED_DISK_V2, m_Sectors=1, m_Size=len(bat), m_FirstBlockOffset=1
+    )
+    header.m_SizeInSectors_v2 = len(bat)
+    bat = c_hdd.uint32[len(bat)](bat).dumps()
+
+    return BytesIO((header.dumps() + bat).ljust(512, b"\x00") + data)
+
+
+def test_hds_sparse_run_before_adjacent_data() -> None:
+    # Two 1 sector clusters, the first is sparse and the second is stored at file offset 512
+    # This file offset is equal to the size of the preceding sparse run, which must not be merged into it
+    hds = HDS(_build_hds([0, 1], b"\xaa" * 512))
+    assert list(hds._iter_runs(0, 1024)) == [(None, 512), (512, 512)]
+    assert hds.read() == b"\x00" * 512 + b"\xaa" * 512
+
+
+def test_snapshots_top_guid() -> None:
+    xml = """
+    <Snapshots>
+        <TopGUID>{9d1f0a4e-59b1-4d2c-a1f6-3d0a3c1e6b21}</TopGUID>
+        <Shot>
+            <GUID>{5fbaabe3-6958-40ff-92a7-860e329aab41}</GUID>
+            <ParentGUID>{00000000-0000-0000-0000-000000000000}</ParentGUID>
+        </Shot>
+        <Shot>
+            <GUID>{9d1f0a4e-59b1-4d2c-a1f6-3d0a3c1e6b21}</GUID>
+            <ParentGUID>{5fbaabe3-6958-40ff-92a7-860e329aab41}</ParentGUID>
+        </Shot>
+    </Snapshots>
+    """
+
+    snapshots = Snapshots.from_xml(ElementTree.fromstring(xml.strip()))
+    assert snapshots.top_guid == UUID("{9d1f0a4e-59b1-4d2c-a1f6-3d0a3c1e6b21}")
+    assert snapshots.find_shot(snapshots.top_guid).parent == UUID("{5fbaabe3-6958-40ff-92a7-860e329aab41}")
+
+
+def test_hds_truncated_bat() -> None:
+    header = c_hdd.pvd_header(m_Sig=c_hdd.SIGNATURE_STRUCTURED_DISK_V2, m_Sectors=1, m_Size=100, m_FirstBlockOffset=1)
+    header.m_SizeInSectors_v2 = 100
+
+    hds = HDS(BytesIO(header.dumps() + c_hdd.uint32[3]([0, 1, 2]).dumps()))
+    with pytest.raises(EOFError, match="Read 12 bytes, but expected 400"):
+        hds.read(512)
+
+
+def test_hds_truncated_data() -> None:
+    hds = HDS(_build_hds([1, 2], b"\xaa" * 512))
+    with pytest.raises(EOFError, match="Read 512 bytes, but expected 1024"):
+        hds.read(1024)
+
+
+def test_hds_short_parent() -> None:
+    # The parent ends halfway the second sector, anything past it reads as zeroes
+    parent = b"\xbb" * 768
+
+    # A single sparse run, read from the parent on its own
+    hds = HDS(_build_hds([1, 0, 0], b"\xaa" * 512), BytesIO(parent))
+    assert hds.read() == b"\xaa" * 512 + b"\xbb" * 256 + b"\x00" * 768
+
+    # Mostly sparse, read from the parent in one go
+    hds = HDS(_build_hds([0, 1, 0], b"\xaa" * 512), BytesIO(parent))
+    assert hds.read() == b"\xbb" * 512 + b"\xaa" * 512 + b"\x00" * 512
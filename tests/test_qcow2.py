@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import random
+import zlib
+from io import BytesIO
+
+import pytest
+
+from dissect.hypervisor.disk import qcow2 as qcow2_mod
+from dissect.hypervisor.disk.c_qcow2 import QCOW2_MAGIC, QCow2SubclusterType, c_qcow2
+from dissect.hypervisor.disk.qcow2 import QCow2
+
+
+def _build_qcow2(
+    cluster_bits: int, l2_entries: list[int], data: bytes, incompatible_features: int = 0, size: int | None = None
+) -> BytesIO:
+    # Minimal version 3 image: header in cluster 0, L1 table in cluster 1, a single L2 table in cluster 2
+    # and the given data from cluster 3 onwards
+    cluster_size = 1 << cluster_bits
+    size = len(data) if size is None else size
+
+    header = c_qcow2.QCowHeader(
+        magic=QCOW2_MAGIC,
+        version=3,
+        cluster_bits=cluster_bits,
+        size=size,
+        l1_size=1,
+        l1_table_offset=cluster_size,
+        incompatible_features=incompatible_features,
+        refcount_order=4,
+        header_length=len(c_qcow2.QCowHeader),
+    ).dumps()
+    l1_table = c_qcow2.uint64[1]([(2 * cluster_size) | c_qcow2.QCOW_OFLAG_COPIED]).dumps()
+    l2_table = c_qcow2.uint64[len(l2_entries)](l2_entries).dumps()
+
+    return BytesIO(
+        header.ljust(cluster_size, b"\x00")
+        + l1_table.ljust(cluster_size, b"\x00")
+        + l2_table.ljust(cluster_size, b"\x00")
+        + data
+    )
+
+
+def test_qcow2_extended_l2_contiguous_single_run() -> None:
+    cluster_bits = 14
+    cluster_size = 1 << cluster_bits
+    data = b"".join(bytes([i + 1]) * cluster_size for i in range(4))
+
+    l2_entries = []
+    for i in range(4):
+        # Fully allocated clusters stored back to back, the bitmap has all allocation bits set
+        l2_entries.append(((3 + i) * cluster_size) | c_qcow2.QCOW_OFLAG_COPIED)
+        l2_entries.append(0xFFFFFFFF)
+
+    fh = _build_qcow2(cluster_bits, l2_entries, data, c_qcow2.QCOW2_INCOMPAT_EXTL2)
+    qcow2 = QCow2(fh)
+
+    assert qcow2.has_subclusters
+    assert list(qcow2._yield_runs(0, len(data))) == [
+        (QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL, 0, 3 * cluster_size, len(data))
+    ]
+    assert qcow2.read() == data
+
+
+def test_qcow2_read_beyond_l1_table() -> None:
+    cluster_bits = 9
+    cluster_size = 1 << cluster_bits
+    data = b"\xaa" * cluster_size
+
+    # A single L1 entry only covers 64 clusters of 512 bytes, the rest of the disk must read as zeroes
+    l2_size = cluster_size // 8
+    fh = _build_qcow2(cluster_bits, [3 * cluster_size], data, size=2 * l2_size * cluster_size)
+    qcow2 = QCow2(fh)
+
+    assert qcow2.header.l1_size == 1
+    assert list(qcow2._yield_runs(l2_size * cluster_size, cluster_size)) == [
+        (QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_PLAIN, l2_size * cluster_size, 0, cluster_size)
+    ]
+    assert list(qcow2._yield_runs(qcow2.size, cluster_size)) == []
+
+    buf = qcow2.read()
+    assert len(buf) == qcow2.size
+    assert buf[:cluster_size] == data
+    assert buf[cluster_size:] == b"\x00" * (qcow2.size - cluster_size)
+
+
+def test_qcow2_l2_cache_size() -> None:
+    cluster_bits = 9
+    cluster_size = 1 << cluster_bits
+    data = b"\xaa" * cluster_size
+
+    # All (one) L2 tables are cached by default
+    qcow2 = QCow2(_build_qcow2(cluster_bits, [3 * cluster_size], data))
+    assert qcow2.l2_table.cache_info().maxsize == 1
+
+    # An explicit cache size is honoured, even if all L2 tables would fit
+    qcow2 = QCow2(_build_qcow2(cluster_bits, [3 * cluster_size], data), l2_cache_size=0)
+    assert qcow2.l2_table.cache_info().maxsize == 0
+    assert qcow2.read() == data
+    assert qcow2.l2_table.cache_info().currsize == 0
+
+
+def test_qcow2_partially_contiguous_runs() -> None:
+    cluster_bits = 9
+    cluster_size = 1 << cluster_bits
+    data = b"".join(bytes([i + 1]) * cluster_size for i in range(6))
+
+    # Three clusters stored back to back, followed by three clusters stored in reverse order
+    host_clusters = [3, 4, 5, 8, 7, 6]
+    l2_entries = [(host * cluster_size) | c_qcow2.QCOW_OFLAG_COPIED for host in host_clusters]
+
+    fh = _build_qcow2(cluster_bits, l2_entries, data, size=len(host_clusters) * cluster_size)
+    qcow2 = QCow2(fh)
+
+    normal = QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL
+    assert list(qcow2._yield_runs(0, qcow2.size)) == [
+        (normal, 0, 3 * cluster_size, 3 * cluster_size),
+        (normal, 3 * cluster_size, 8 * cluster_size, cluster_size),
+        (normal, 4 * cluster_size, 7 * cluster_size, cluster_size),
+        (normal, 5 * cluster_size, 6 * cluster_size, cluster_size),
+    ]
+    assert qcow2.read() == data[: 3 * cluster_size] + data[3 * cluster_size :][::-1]
+
+
+def test_qcow2_coalesce_reads() -> None:
+    cluster_bits = 9
+    cluster_size = 1 << cluster_bits
+    data = b"".join(bytes([i + 1]) * cluster_size for i in range(4))
+
+    l2_entries = [
+        (3 * cluster_size) | c_qcow2.QCOW_OFLAG_COPIED,
+        (4 * cluster_size) | c_qcow2.QCOW_OFLAG_COPIED,
+        c_qcow2.QCOW_OFLAG_ZERO,
+        (5 * cluster_size) | c_qcow2.QCOW_OFLAG_ZERO,
+        0,
+        (6 * cluster_size) | c_qcow2.QCOW_OFLAG_COPIED,
+    ]
+
+    fh = _build_qcow2(cluster_bits, l2_entries, data, size=len(l2_entries) * cluster_size)
+    qcow2 = QCow2(fh)
+
+    # Without a backing file, zero and unallocated clusters all read as zeroes and end up in one run
+    assert list(qcow2._yield_reads(0, qcow2.size)) == [
+        (QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL, 0, 3 * cluster_size, 2 * cluster_size),
+        (QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_PLAIN, 2 * cluster_size, 0, 3 * cluster_size),
+        (QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL, 5 * cluster_size, 6 * cluster_size, cluster_size),
+    ]
+    assert qcow2.read() == data[: 2 * cluster_size] + b"\x00" * (3 * cluster_size) + data[3 * cluster_size :]
+
+
+def test_qcow2_extended_l2_subcluster_bitmap() -> None:
+    cluster_bits = 14
+    cluster_size = 1 << cluster_bits
+    subcluster_size = cluster_size // 32
+    data = b"\xaa" * cluster_size + b"\xbb" * cluster_size
+
+    # The first half of the first cluster is allocated and the rest reads as zeroes,
+    # the second cluster only has its last subcluster allocated
+    l2_entries = [
+        (3 * cluster_size) | c_qcow2.QCOW_OFLAG_COPIED,
+        0x0000FFFF | (0xFFFF0000 << 32),
+        (4 * cluster_size) | c_qcow2.QCOW_OFLAG_COPIED,
+        0x80000000,
+    ]
+
+    fh = _build_qcow2(cluster_bits, l2_entries, data, c_qcow2.QCOW2_INCOMPAT_EXTL2)
+    qcow2 = QCow2(fh)
+
+    assert list(qcow2._yield_runs(0, qcow2.size)) == [
+        (QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL, 0, 3 * cluster_size, cluster_size // 2),
+        (
+            QCow2SubclusterType.QCOW2_SUBCLUSTER_ZERO_ALLOC,
+            cluster_size // 2,
+            3 * cluster_size + cluster_size // 2,
+            cluster_size // 2,
+        ),
+        (
+            QCow2SubclusterType.QCOW2_SUBCLUSTER_UNALLOCATED_ALLOC,
+            cluster_size,
+            4 * cluster_size,
+            cluster_size - subcluster_size,
+        ),
+        (
+            QCow2SubclusterType.QCOW2_SUBCLUSTER_NORMAL,
+            2 * cluster_size - subcluster_size,
+            5 * cluster_size - subcluster_size,
+            subcluster_size,
+        ),
+    ]
+
+    zero_length = 2 * cluster_size - cluster_size // 2 - subcluster_size
+    assert qcow2.read() == b"\xaa" * (cluster_size // 2) + b"\x00" * zero_length + b"\xbb" * subcluster_size
+
+
+@pytest.mark.parametrize(
+    "use_deflate",
+    [False, pytest.param(True, marks=pytest.mark.skipif(not qcow2_mod.HAS_DEFLATE, reason="deflate not available"))],
+)
+def test_qcow2_compressed_cluster(use_deflate: bool, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(qcow2_mod, "HAS_DEFLATE", use_deflate)
+
+    cluster_bits = 12
+    cluster_size = 1 << cluster_bits
+    csize_shift = 62 - (cluster_bits - 8)
+
+    rng = random.Random(1337)
+    clusters = [rng.randbytes(cluster_size // 2) + bytes([i + 1]) * (cluster_size // 2) for i in range(2)]
+    streams = []
+    for cluster in clusters:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -12)
+        streams.append(compressor.compress(cluster) + compressor.flush())
+
+    # The first stream starts halfway a sector and is followed by junk up to the end of its last sector,
+    # which is included in its compressed size
+    # The second stream is cut short at a sector boundary and must be salvaged as far as possible
+    first_offset = 3 * cluster_size + 100
+    first_sectors = (100 + len(streams[0]) + 511) // 512
+    second_offset = 3 * cluster_size + first_sectors * 512
+    truncated = streams[1][:1024]
+
+    data = b"\x00" * 100 + streams[0]
+    data = data.ljust(first_sectors * 512, b"\xcc") + truncated
+    data = data.ljust(-(-len(data) // cluster_size) * cluster_size, b"\x00")
+
+    l2_entries = [
+        c_qcow2.QCOW_OFLAG_COMPRESSED | ((first_sectors - 1) << csize_shift) | first_offset,
+        c_qcow2.QCOW_OFLAG_COMPRESSED | ((len(truncated) // 512 - 1) << csize_shift) | second_offset,
+        c_qcow2.QCOW_OFLAG_COMPRESSED | ((first_sectors - 1) << csize_shift) | first_offset,
+    ]
+    qcow2 = QCow2(_build_qcow2(cluster_bits, l2_entries, data, size=3 * cluster_size))
+
+    salvaged = zlib.decompressobj(-12).decompress(truncated)
+    assert 0 < len(salvaged) < cluster_size
+    expected_second = salvaged + b"\x00" * (cluster_size - len(salvaged))
+    assert qcow2.read() == clusters[0] + expected_second + clusters[0]
+
+    # The first and last cluster share a descriptor, so the last one is decompressed only once
+    assert qcow2._read_compressed_cluster.cache_info().hits == 1
+
+    qcow2.seek(cluster_size + 10)
+    assert qcow2.read(100) == expected_second[10:110]
+
+
+def test_qcow2_snapshot_interleaved_reads() -> None:
+    cluster_bits = 9
+    cluster_size = 1 << cluster_bits
+
+    # Header in cluster 0, the L1 and L2 table of the disk in cluster 1 and 2, those of the snapshot in
+    # cluster 3 and 4, the snapshot table in cluster 5 and data clusters from cluster 6 onwards
+    # The snapshot has its own first cluster and shares the second one with the disk
+    header = c_qcow2.QCowHeader(
+        magic=QCOW2_MAGIC,
+        version=3,
+        cluster_bits=cluster_bits,
+        size=2 * cluster_size,
+        l1_size=1,
+        l1_table_offset=1 * cluster_size,
+        nb_snapshots=1,
+        snapshots_offset=5 * cluster_size,
+        refcount_order=4,
+        header_length=len(c_qcow2.QCowHeader),
+    ).dumps()
+    snapshot = c_qcow2.QCowSnapshotHeader(
+        l1_table_offset=3 * cluster_size,
+        l1_size=1,
+        id_str_size=1,
+        name_size=4,
+        extra_data_size=len(c_qcow2.QCowSnapshotExtraData),
+    ).dumps()
+    snapshot += c_qcow2.QCowSnapshotExtraData(disk_size=2 * cluster_size).dumps() + b"1" + b"snap"
+
+    tables = [
+        [2 * cluster_size | c_qcow2.QCOW_OFLAG_COPIED],
+        [6 * cluster_size | c_qcow2.QCOW_OFLAG_COPIED, 7 * cluster_size],
+        [4 * cluster_size],
+        [8 * cluster_size | c_qcow2.QCOW_OFLAG_COPIED, 7 * cluster_size],
+    ]
+    fh = BytesIO(
+        header.ljust(cluster_size, b"\x00")
+        + b"".join(c_qcow2.uint64[len(table)](table).dumps().ljust(cluster_size, b"\x00") for table in tables)
+        + snapshot.ljust(cluster_size, b"\x00")
+        + b"\xaa" * cluster_size
+        + b"\xbb" * cluster_size
+        + b"\xcc" * cluster_size
+    )
+
+    disk = QCow2(fh)
+    snapshot_disk = disk.snapshots[0].open()
+    assert disk.snapshots[0].name == "snap"
+
+    # The views share their caches and read-ahead state
+    assert snapshot_disk.l2_table is disk.l2_table
+    assert snapshot_disk._readahead is disk._readahead
+
+    disk_data = b"\xaa" * cluster_size + b"\xbb" * cluster_size
+    snapshot_data = b"\xcc" * cluster_size + b"\xbb" * cluster_size
+    for offset in (0, 10, cluster_size - 10, cluster_size + 10):
+        disk.seek(offset)
+        snapshot_disk.seek(offset)
+        assert snapshot_disk.read(100) == snapshot_data[offset : offset + 100]
+        assert disk.read(100) == disk_data[offset : offset + 100]
+        assert snapshot_disk.read(100) == snapshot_data[offset + 100 : offset + 200]
+        assert disk.read(100) == disk_data[offset + 100 : offset + 200]
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import os
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+import pytest
+
+from dissect.hypervisor.util.readahead import SequentialReadahead
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+@pytest.mark.skipif(not hasattr(os, "posix_fadvise"), reason="posix_fadvise not available")
+def test_sequential_readahead(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    advice = []
+    monkeypatch.setattr(os, "posix_fadvise", lambda fd, offset, length, value: advice.append(value))
+
+    path = tmp_path / "disk.img"
+    path.write_bytes(b"\x00" * 4096)
+
+    with path.open("rb") as fh:
+        readahead = SequentialReadahead(fh)
+
+        readahead.update(0, 512)
+        readahead.update(512, 512)
+        assert advice == []
+
+        readahead.update(1024, 512)
+        assert readahead.sequential
+        assert advice == [os.POSIX_FADV_SEQUENTIAL]
+
+        readahead.update(1536, 512)
+        assert advice == [os.POSIX_FADV_SEQUENTIAL]
+
+        readahead.update(0, 512)
+        assert not readahead.sequential
+        assert advice == [os.POSIX_FADV_SEQUENTIAL, os.POSIX_FADV_NORMAL]
+
+
+def test_sequential_readahead_no_fileno() -> None:
+    readahead = SequentialReadahead(BytesIO(b"\x00" * 4096))
+    assert readahead.fd is None
+
+    for offset in range(0, 4096, 512):
+        readahead.update(offset, 512)
+
+    assert not readahead.sequential
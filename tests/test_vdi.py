@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from io import BytesIO
+
+from dissect.hypervisor.disk.c_vdi import SPARSE, UNALLOCATED, VDI_SIGNATURE, c_vdi
+from dissect.hypervisor.disk.vdi import VDI
+
+
+def _build_vdi(block_size: int, block_map: list[int], data: bytes) -> BytesIO:
+    # Minimal dynamic image: header in the first sector, the block map in the second and the data after that
+    header = c_vdi.HeaderDescriptor(
+        FileInfo=b"<<< Oracle VM VirtualBox Disk Image >>>\n",
+        Signature=VDI_SIGNATURE,
+        Version=0x00010001,
+        HeaderSize=0x190,
+        ImageType=c_vdi.ImageType.Dynamic,
+        BlocksOffset=512,
+        DataOffset=1024,
+        SectorSize=512,
+        DiskSize=len(block_map) * block_size,
+        BlockSize=block_size,
+        BlocksInHDD=len(block_map),
+        BlocksAllocated=sum(block >= 0 for block in block_map),
+    ).dumps()
+    block_map = c_vdi.int32[len(block_map)](block_map).dumps()
+
+    return BytesIO(header.ljust(512, b"\x00") + block_map.ljust(512, b"\x00") + data)
+
+
+def test_vdi_read_runs() -> None:
+    block_size = 4096
+    data = b"".join(bytes([i + 1]) * block_size for i in range(4))
+
+    # Blocks 0 and 1 are stored back to back, block 3 comes before block 2 in the image file
+    block_map = [0, 1, SPARSE, UNALLOCATED, 3, 2]
+    vdi = VDI(_build_vdi(block_size, block_map, data))
+
+    assert list(vdi._iter_runs(0, vdi.size)) == [
+        (0, 0, 2 * block_size),
+        (SPARSE, 2 * block_size, block_size),
+        (UNALLOCATED, 3 * block_size, block_size),
+        (3, 4 * block_size, block_size),
+        (2, 5 * block_size, block_size),
+    ]
+    assert list(vdi._iter_runs(block_size + 512, 512)) == [(1, block_size + 512, 512)]
+
+    expected = (
+        data[: 2 * block_size]
+        + b"\x00" * (2 * block_size)
+        + data[3 * block_size :]
+        + data[2 * block_size : 3 * block_size]
+    )
+    assert vdi.read() == expected
+
+    vdi.seek(block_size - 512)
+    assert vdi.read(1024) == expected[block_size - 512 : block_size + 512]
+
+    # Blocks 4 and 5 are not adjacent in the image file, so this read must be split at the block boundary
+    assert list(vdi._iter_runs(5 * block_size - 512, 1024)) == [
+        (3, 5 * block_size - 512, 512),
+        (2, 5 * block_size, 512),
+    ]
+    vdi.seek(5 * block_size - 512)
+    assert vdi.read(1024) == expected[5 * block_size - 512 : 5 * block_size + 512]
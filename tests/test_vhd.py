@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+from io import BytesIO
 from typing import BinaryIO
 
-from dissect.hypervisor.disk.vhd import VHD, DynamicDisk, FixedDisk
+import pytest
+
+from dissect.hypervisor.disk.c_vhd import c_vhd
+from dissect.hypervisor.disk.vhd import VHD, BlockAllocationTable, DynamicDisk, FixedDisk
 
 
 def test_vhd_fixed(fixed_vhd: BinaryIO) -> None:
@@ -60,3 +64,80 @@ def test_vhd_dynamic(dynamic_vhd: BinaryIO) -> None:
     vhd.seek(0x200000)
     assert vhd.read(512) == b"\xff" * 512
     assert vhd.disk.read_sectors(0x3FFF, 16) == (b"\x00" * 512 * 16)
+
+
+def _build_dynamic_vhd(block_size: int, bat: list[int | None], data: bytes) -> BytesIO:
+    # Minimal dynamic image: footer copy in the first sector, the dynamic header in the next two sectors,
+    # the BAT in the fourth sector and the blocks (each with a single sector bitmap) after that
+    footer = c_vhd.footer(
+        cookie=b"conectix",
+        features=0x00000002,
+        version=0x00010000,
+        data_offset=512,
+        original_size=len(bat) * block_size,
+        current_size=len(bat) * block_size,
+        disk_type=3,
+    ).dumps()
+    # The footer structure is a byte short of a sector
+    footer = footer.ljust(512, b"\x00")
+    header = c_vhd.dynamic_header(
+        cookie=b"cxsparse",
+        data_offset=0xFFFFFFFFFFFFFFFF,
+        table_offset=3 * 512,
+        header_version=0x00010000,
+        max_table_entries=len(bat),
+        block_size=block_size,
+    ).dumps()
+    bat = c_vhd.uint32[len(bat)]([0xFFFFFFFF if entry is None else entry for entry in bat]).dumps()
+
+    return BytesIO(footer + header + bat.ljust(512, b"\x00") + data + footer)
+
+
+def test_vhd_dynamic_read_runs() -> None:
+    block_size = 4096
+    # Every block is preceded by its sector bitmap
+    blocks = [bytes([i + 1]) * block_size for i in range(3)]
+    data = b"".join(b"\xff" * 512 + block for block in blocks)
+
+    sectors_per_block = block_size // 512
+    bat = [4 + 2 * (1 + sectors_per_block), None, None, 4, 4 + (1 + sectors_per_block), None]
+    vhd = VHD(_build_dynamic_vhd(block_size, bat, data))
+
+    assert list(vhd.disk._iter_runs(0, vhd.size // 512)) == [
+        (bat[0], 0, sectors_per_block),
+        (None, sectors_per_block, 2 * sectors_per_block),
+        (bat[3], 3 * sectors_per_block, sectors_per_block),
+        (bat[4], 4 * sectors_per_block, sectors_per_block),
+        (None, 5 * sectors_per_block, sectors_per_block),
+    ]
+    assert list(vhd.disk._iter_runs(sectors_per_block - 1, 2)) == [
+        (bat[0], sectors_per_block - 1, 1),
+        (None, sectors_per_block, 1),
+    ]
+
+    expected = blocks[2] + b"\x00" * (2 * block_size) + blocks[0] + blocks[1] + b"\x00" * block_size
+    assert vhd.read() == expected
+
+    vhd.seek(block_size - 512)
+    assert vhd.read(1024) == expected[block_size - 512 : block_size + 512]
+
+
+def test_vhd_dynamic_zero_bat_entry() -> None:
+    block_size = 4096
+    sectors_per_block = block_size // 512
+    data = b"\xff" * 512 + b"\x01" * block_size
+
+    # A BAT entry of 0 reads as sparse, just like 0xFFFFFFFF
+    vhd = VHD(_build_dynamic_vhd(block_size, [0, 4, None, 0], data))
+    assert list(vhd.disk._iter_runs(0, vhd.size // 512)) == [
+        (None, 0, sectors_per_block),
+        (4, sectors_per_block, sectors_per_block),
+        (None, 2 * sectors_per_block, 2 * sectors_per_block),
+    ]
+    assert vhd.read() == b"\x00" * block_size + b"\x01" * block_size + b"\x00" * (2 * block_size)
+
+
+def test_vhd_truncated_bat() -> None:
+    bat = BlockAllocationTable(BytesIO(b"\x00" * 10), 0, 4)
+    with pytest.raises(EOFError, match="Read 10 bytes, but expected 16"):
+        bat.get(0)
@@ -1,11 +1,12 @@
 from __future__ import annotations
 
+import io
 from typing import BinaryIO
 from uuid import UUID
 
 import pytest
 
-from dissect.hypervisor.disk.vhdx import VHDX, _iter_partial_runs, c_vhdx
+from dissect.hypervisor.disk.vhdx import VHDX, BlockAllocationTable, _iter_partial_runs, c_vhdx
 
 
 def test_vhdx_fixed(fixed_vhdx: BinaryIO) -> None:
@@ -78,6 +79,15 @@ def test_vhdx_dynamic(dynamic_vhdx: BinaryIO) -> None:
     assert v.read(512) == b"\xff" * 512
 
 
+def test_vhdx_truncated_bat(dynamic_vhdx: BinaryIO) -> None:
+    v = VHDX(dynamic_vhdx)
+
+    # Place the BAT so that only half of its single entry is in the file
+    bat = BlockAllocationTable(v, dynamic_vhdx.seek(0, io.SEEK_END) - 4)
+    with pytest.raises(EOFError, match="Read 4 bytes, but expected 8"):
+        bat.get(0)
+
+
 def test_vhdx_differencing(differencing_vhdx: BinaryIO) -> None:
     with pytest.raises(IOError, match="Failed to open parent disk with locator"):
         VHDX(differencing_vhdx)
@@ -98,6 +108,9 @@ def test_vhdx_differencing(differencing_vhdx: BinaryIO) -> None:
         ((b"\x0f\x0f", 0, 16), [(1, 4), (0, 4), (1, 4), (0, 4)]),
         ((b"\x00", 0, 6), [(0, 6)]),
         ((b"\x00", 1, 6), [(0, 6)]),
+        ((b"\xf0\x0f", 2, 12), [(0, 2), (1, 8), (0, 2)]),
+        ((b"\xff" * 9 + b"\x00", 0, 80), [(1, 72), (0, 8)]),
+        ((b"\xff" * 8 + b"\xfe", 4, 64), [(1, 60), (0, 1), (1, 3)]),
     ],
 )
 def test_vhdx_partial_runs(test_input: tuple[bytes, int, int], expected: list[tuple[int, int]]) -> None:
@@ -4,7 +4,7 @@ from typing import BinaryIO
 
 import pytest
 
-from dissect.hypervisor.descriptor.vmx import HAS_PYCRYPTODOME, HAS_PYSTANDALONE, VMX
+from dissect.hypervisor.descriptor.vmx import HAS_PYCRYPTODOME, HAS_PYSTANDALONE, VMX, _parse_crypto_dict
 
 
 def test_vmx() -> None:
@@ -74,3 +74,21 @@ def test_vmx_encrypted(encrypted_vmx: BinaryIO) -> None:
     vmx.unlock_with_phrase("password")
 
     assert "datafilekey" in vmx.attr
+
+
+@pytest.mark.skipif((not HAS_PYCRYPTODOME and not HAS_PYSTANDALONE), reason="No crypto module available")
+def test_vmx_encrypted_wrong_phrase(encrypted_vmx: BinaryIO) -> None:
+    vmx = VMX.parse(encrypted_vmx.read().decode())
+
+    with pytest.raises(ValueError, match="No compatible locator"):
+        vmx.unlock_with_phrase("wrong password")
+
+
+def test_parse_crypto_dict() -> None:
+    assert _parse_crypto_dict("type=key:cipher=AES-256:key=a%2Bb%3Ac%3D") == {
+        "type": "key",
+        "cipher": "AES-256",
+        "key": "a+b:c=",
+    }
+    # Empty values are kept, parts without a value are skipped
+    assert _parse_crypto_dict("type=:bogus::cipher=AES-256") == {"type": "", "cipher": "AES-256"}